@@ -0,0 +1,192 @@
+""" Caches of serialized documents and site navigation
+
+Serializing a content item for ``@@json`` runs its schema, looks up its
+workflow and builds the whole relational metadata, although most items are
+read many times between two edits. :class:`DocumentCache` keeps the
+serialized documents in a size and time bounded LRU cache, keyed by the
+document's ``ETag`` (see :func:`~kotti_jsonapi.validators.content_etag`)
+and the application URL.
+
+The ``ETag`` is derived from the content, its ancestors and its children
+as stored in the database, so the entries of a changed object are never
+hit again, in any process, as soon as the change is committed. Everything
+else that a document shows (e.g. the navigation items of siblings) may be
+stale for at most ``timeout`` seconds. The parts of a document that depend
+on the request's URL aren't cached (see
+:data:`~kotti_jsonapi.serializers.REQUEST_SECTIONS`).
+
+The cache is configured with these settings:
+
+``kotti_jsonapi.document_cache_size``
+    Maximum number of documents kept, ``0`` disables the cache (default
+    ``1000``).
+
+``kotti_jsonapi.document_cache_timeout``
+    Maximum age of a cached document in seconds (default ``60``).
+
+The navigation items, site setup links and addable content types of
+:func:`~kotti_jsonapi.serializers.relational_metadata` only change with the
+site's structure, the permissions or the registered types, yet they were
+rebuilt by every request. :class:`SiteCache` keeps them across requests,
+keyed by the requester's effective principals (the addable types by the
+content's type and what's permitted on it, so siblings share them). Any
+content event clears it once its transaction is committed, as these
+depend on more than the lineage of the changed object; until then, the
+request making the change doesn't use it. Other processes see the change
+after at most ``timeout`` seconds. It's configured with
+``kotti_jsonapi.site_cache_size`` (default ``1000``, ``0`` disables it) and
+``kotti_jsonapi.site_cache_timeout`` (default ``300``).
+"""
+
+import hashlib
+
+import transaction
+from kotti.events import ObjectDelete
+from kotti.events import ObjectInsert
+from kotti.events import ObjectUpdate
+from kotti.events import subscribe
+from pyramid.threadlocal import get_current_registry
+from pyramid.threadlocal import get_current_request
+from repoze.lru import ExpiringLRUCache
+
+from kotti_jsonapi.security import get_permission_evaluator
+
+CACHE_KEY = 'kotti_jsonapi.document_cache'
+DEFAULT_SIZE = 1000
+DEFAULT_TIMEOUT = 60
+SITE_CACHE_KEY = 'kotti_jsonapi.site_cache'
+DEFAULT_SITE_TIMEOUT = 300
+SITE_CHANGED_ATTR = '_kotti_jsonapi_site_changed'
+
+
+def _principals_digest(principals):
+    return hashlib.sha1(repr(sorted(principals)).encode('utf-8')).hexdigest()
+
+
+class DocumentCache(object):
+    """ An LRU cache of serialized documents, keyed by their ``ETag``.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.lru = ExpiringLRUCache(size, default_timeout=timeout)
+
+    def key(self, etag, request):
+        """ Returns the cache key for the document with ``etag`` as served
+        to the current request.
+        """
+        return (etag, request.application_url)
+
+    def get(self, key):
+        return self.lru.get(key)
+
+    def put(self, key, document):
+        self.lru.put(key, document)
+
+    def clear(self):
+        self.lru.clear()
+
+
+class SiteCache(object):
+    """ An LRU cache of the site level parts of the relational metadata.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, timeout=DEFAULT_SITE_TIMEOUT):
+        self.lru = ExpiringLRUCache(size, default_timeout=timeout)
+
+    def get_or_compute(self, context, request, name, compute, *parts):
+        """ Returns the value ``name`` of ``context``, as seen by the current
+        request, calling ``compute`` if it isn't cached. ``parts`` are
+        added to the key.
+
+        Requests that changed content neither use nor fill the cache.
+        """
+        if getattr(context, 'id', None) is None or \
+                getattr(request, SITE_CHANGED_ATTR, False):
+            return compute()
+        principals = get_permission_evaluator(context, request).principals
+        key = (name, context.id, request.application_url,
+               _principals_digest(principals)) + parts
+        return self.lookup(key, request, compute)
+
+    def lookup(self, key, request, compute):
+        """ Returns the value cached under ``key``, calling ``compute`` if
+        there's none. The caller makes sure that ``key`` covers everything
+        the value depends on.
+        """
+        if getattr(request, SITE_CHANGED_ATTR, False):
+            return compute()
+        value = self.lru.get(key)
+        if value is None:
+            value = compute()
+            self.lru.put(key, value)
+        return value
+
+    def clear(self):
+        self.lru.clear()
+
+
+def get_document_cache(registry):
+    """ Returns the :class:`DocumentCache` of ``registry``, ``None`` if
+    caching is disabled.
+    """
+    return registry.get(CACHE_KEY)
+
+
+def get_site_cache(registry):
+    """ Returns the :class:`SiteCache` of ``registry``, ``None`` if caching
+    is disabled.
+    """
+    return registry.get(SITE_CACHE_KEY)
+
+
+def includeme(config):
+    settings = config.registry.settings
+    size = int(settings.get('kotti_jsonapi.document_cache_size',
+                            DEFAULT_SIZE))
+    timeout = int(settings.get('kotti_jsonapi.document_cache_timeout',
+                               DEFAULT_TIMEOUT))
+    if size > 0:
+        config.registry[CACHE_KEY] = DocumentCache(size, timeout)
+    else:
+        config.registry.pop(CACHE_KEY, None)
+
+    size = int(settings.get('kotti_jsonapi.site_cache_size', DEFAULT_SIZE))
+    timeout = int(settings.get('kotti_jsonapi.site_cache_timeout',
+                               DEFAULT_SITE_TIMEOUT))
+    if size > 0:
+        config.registry[SITE_CACHE_KEY] = SiteCache(size, timeout)
+    else:
+        config.registry.pop(SITE_CACHE_KEY, None)
+    config.scan(__name__)
+
+
+def _event_registry(event):
+    registry = getattr(event.request, 'registry', None)
+    if registry is None:
+        registry = get_current_registry()
+    return registry
+
+
+def _clear_after_commit(status, cache):
+    if status:
+        cache.clear()
+
+
+@subscribe(ObjectInsert)
+@subscribe(ObjectUpdate)
+@subscribe(ObjectDelete)
+def clear_site_cache(event):
+    """ Clears the site cache when the transaction is committed: added,
+    moved or removed content, changed permissions and group memberships
+    can all change the navigation.
+    """
+    cache = get_site_cache(_event_registry(event))
+    if cache is None:
+        return
+    request = event.request or get_current_request()
+    if request is not None:
+        setattr(request, SITE_CHANGED_ATTR, True)
+    txn = transaction.get()
+    if not any(hook is _clear_after_commit
+               for hook, args, kws in txn.getAfterCommitHooks()):
+        txn.addAfterCommitHook(_clear_after_commit, args=(cache,))
@@ -0,0 +1,73 @@
+""" The site chrome
+
+Most of ``relationships.meta`` is the same on every page of the site: the
+current user, the site's title and URLs, the navigation items and the site
+setup links (see :data:`~kotti_jsonapi.serializers.SITE_SECTIONS`).
+
+``GET <context>/@@chrome-json`` returns just those sections::
+
+    {"data": {"type": "chrome", "id": "",
+              "attributes": {"current_user": {...}, "site_title": "...",
+                             "navitems": [...], ...}}}
+
+so that a client can fetch them once and ask for the content with
+``chrome=false``, which leaves them out of ``@@json`` and of each child of
+``@@contents-json``.
+
+The chrome is the same for all the pages under a navigation root, so it
+leaves out what depends on the page: the navigation items have no
+``inside`` flag (the client knows the current page's lineage from its
+breadcrumbs), and the ``logout_url`` has no ``came_from``.
+
+The response has its own ``ETag``, see
+:func:`~kotti_jsonapi.validators.chrome_etag`, and may be kept by the
+client for ``kotti_jsonapi.chrome_max_age`` seconds (``300`` by default).
+"""
+
+from pyramid.view import view_config
+
+from kotti_jsonapi.rest import ACCEPT
+from kotti_jsonapi.rest import BaseRestView
+from kotti_jsonapi.serializers import SITE_SECTIONS
+from kotti_jsonapi.serializers import get_relmeta_context
+from kotti_jsonapi.serializers import relational_metadata
+from kotti_jsonapi.validators import check_validators
+from kotti_jsonapi.validators import chrome_etag
+
+DEFAULT_MAX_AGE = 300
+
+
+@view_config(name='chrome-json', accept=ACCEPT, renderer='kotti_jsonp',
+             request_method='GET', permission='view')
+class ChromeView(BaseRestView):
+    """ The ``@@chrome-json`` view, see the module's documentation.
+    """
+
+    def __call__(self):
+        settings = self.request.registry.settings
+        max_age = int(settings.get('kotti_jsonapi.chrome_max_age',
+                                   DEFAULT_MAX_AGE))
+        response = self.request.response
+        response.cache_control.private = True
+        response.cache_control.max_age = max_age
+
+        result = check_validators(
+            self.request, chrome_etag(self.context, self.request))
+        if result is not None:
+            result.cache_control = str(response.cache_control)
+            return result
+
+        attributes = relational_metadata(self.context, self.request,
+                                         sections=SITE_SECTIONS)
+        attributes['navitems'] = [
+            dict((key, value) for key, value in item.items()
+                 if key != 'inside')
+            for item in attributes['navitems']]
+        api = get_relmeta_context(self.context, self.request).api
+        attributes['logout_url'] = api.url(api.root, '@@logout')
+        return dict(data=dict(type='chrome', id=api.navigation_root.__name__,
+                              attributes=attributes))
+
+
+def includeme(config):
+    config.scan(__name__)
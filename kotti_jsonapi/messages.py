@@ -0,0 +1,62 @@
+""" Flash messages
+
+Almost every response carries the flash messages of the session in
+``meta.messages``. Popping them loads the session, and Kotti's default
+(beaker) sessions are then created and sent back with a ``Set-Cookie``,
+even for anonymous, read only requests.
+
+:func:`get_messages` leaves the session alone when the request has no
+session cookie, as there can't be any messages then, and otherwise only
+pops the queues that have messages.
+
+The session cookie's name is the ``kotti_jsonapi.session_cookie`` setting,
+by default beaker's ``session.key`` (``beaker.session.id``).
+"""
+
+FLASH_QUEUES = ('info', 'success', 'error', 'warning', '')
+
+
+def _message_key(queue):
+    return queue or 'default'
+
+
+def session_cookie(request):
+    """ Returns the name of the session cookie.
+    """
+    settings = request.registry.settings or {}
+    return settings.get('kotti_jsonapi.session_cookie') or settings.get(
+        'session.key', 'beaker.session.id')
+
+
+def get_session(request):
+    """ Returns the session of ``request`` if it has one, ``None`` if there
+    is no session cookie and the session hasn't been used yet.
+    """
+    if 'session' not in request.__dict__ and \
+            session_cookie(request) not in request.cookies:
+        return None
+    return request.session
+
+
+def _queues_with_messages(session):
+    return [queue for queue in FLASH_QUEUES if session.peek_flash(queue)]
+
+
+def get_messages(request):
+    """ Returns the flash messages of all queues, removing them from the
+    session.
+    """
+    messages = dict((_message_key(queue), []) for queue in FLASH_QUEUES)
+    session = get_session(request)
+    if session is not None:
+        for queue in _queues_with_messages(session):
+            messages[_message_key(queue)] = session.pop_flash(queue)
+    return messages
+
+
+def has_flash_messages(request):
+    """ Tells whether the session has flash messages, without removing
+    them.
+    """
+    session = get_session(request)
+    return session is not None and bool(_queues_with_messages(session))
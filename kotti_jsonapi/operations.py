@@ -0,0 +1,181 @@
+""" JSON:API atomic operations
+
+``POST <context>/@@operations-json`` applies a list of operations, as
+defined by the JSON:API `atomic operations extension
+<https://jsonapi.org/ext/atomic/>`_, in a single transaction::
+
+    {"atomic:operations": [
+        {"op": "add",
+         "data": {"type": "Document", "lid": "folder",
+                  "attributes": {"title": "Folder"}}},
+        {"op": "add",
+         "data": {"type": "Document", "attributes": {"title": "Page"},
+                  "relationships": {"parent": {"data": {"lid": "folder"}}}}},
+        {"op": "update",
+         "ref": {"type": "Document", "id": "about"},
+         "data": {"type": "Document", "attributes": {"title": "About us"}}},
+        {"op": "remove", "href": "/news/old/"}
+    ]}
+
+The target of ``update`` and ``remove`` (and the parent of ``add``, the
+context by default) is given either by ``ref``, with the ``lid`` of a
+node added before or the ``id`` (name) of a child of the context, or by
+``href``, a path from the site root.
+
+The content is validated with the same schemas and permissions as the
+``@@json`` views. If any operation fails, the transaction is doomed so that
+none is applied, and the errors point to the failing operation; otherwise
+the response has one result per operation.
+"""
+
+import colander
+import transaction
+from kotti import DBSession
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPUnprocessableEntity
+from pyramid.traversal import find_resource
+from pyramid.traversal import find_root
+from pyramid.view import view_config
+from zope.interface.interfaces import ComponentLookupError
+
+from kotti_jsonapi.rest import ACCEPT
+from kotti_jsonapi.rest import BaseRestView
+from kotti_jsonapi.rest import create_content
+from kotti_jsonapi.rest import serialize
+from kotti_jsonapi.rest import update_content
+
+OPERATIONS_KEY = 'atomic:operations'
+RESULTS_KEY = 'atomic:results'
+
+
+class OperationError(Exception):
+    """ Raised when an operation can't be applied.
+    """
+
+    def __init__(self, error_class, detail):
+        self.error_class = error_class
+        self.detail = detail
+
+
+class Operations(object):
+    """ Applies atomic operations relative to ``context``, keeping track of
+    the nodes added with a ``lid``.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        self.lids = dict()
+
+    def resolve(self, ref=None, href=None):
+        """ Returns the node that ``ref`` or ``href`` point to, or the
+        context if there are none.
+        """
+        if href is not None:
+            try:
+                return find_resource(find_root(self.context), href)
+            except KeyError:
+                raise OperationError(HTTPNotFound, u'Not found: ' + href)
+        if ref is None:
+            return self.context
+        if 'lid' in ref:
+            if ref['lid'] not in self.lids:
+                raise OperationError(HTTPBadRequest,
+                                     u'Unknown lid: ' + ref['lid'])
+            return self.lids[ref['lid']]
+        try:
+            return self.context[ref['id']]
+        except KeyError:
+            raise OperationError(HTTPNotFound, u'Not found: ' + ref['id'])
+
+    def add(self, operation):
+        data = operation['data']
+        parent = (data.get('relationships') or {}).get('parent')
+        if parent is not None:
+            parent = self.resolve(ref=parent.get('data'))
+        else:
+            parent = self.resolve(ref=operation.get('ref'),
+                                  href=operation.get('href'))
+        node = create_content(parent, self.request, data)
+        if 'lid' in data:
+            self.lids[data['lid']] = node
+        return node
+
+    def update(self, operation):
+        node = self.resolve(ref=operation.get('ref'),
+                            href=operation.get('href'))
+        if not self.request.has_permission('edit', node):
+            raise HTTPForbidden()
+        if operation['data'].get('type') != node.type_info.name:
+            raise OperationError(HTTPBadRequest, u'Type mismatch')
+        return update_content(node, self.request, operation['data'])
+
+    def remove(self, operation):
+        node = self.resolve(ref=operation.get('ref'),
+                            href=operation.get('href'))
+        if node.__parent__ is None:
+            raise OperationError(HTTPBadRequest, u"The root can't be removed")
+        if not self.request.has_permission('delete', node):
+            raise HTTPForbidden()
+        del node.__parent__[node.__name__]
+
+    def apply(self, operation):
+        """ Applies ``operation``, returns the node it added or updated.
+        """
+        op = operation.get('op')
+        if op not in ('add', 'update', 'remove'):
+            raise OperationError(HTTPBadRequest, u'Unknown op: {0}'.format(op))
+        try:
+            return getattr(self, op)(operation)
+        except colander.Invalid as e:
+            raise OperationError(HTTPUnprocessableEntity, e.asdict())
+        except HTTPForbidden:
+            raise OperationError(HTTPForbidden, u'Forbidden')
+        except (KeyError, TypeError, ComponentLookupError):
+            raise OperationError(HTTPBadRequest, u'Invalid operation')
+
+
+def _error(error_class, index, detail):
+    return error_class(content_type=ACCEPT, json_body=dict(errors=[dict(
+        status=str(error_class.code),
+        source=dict(pointer='/{0}/{1}'.format(OPERATIONS_KEY, index)),
+        detail=detail)]))
+
+
+@view_config(name='operations-json', accept=ACCEPT, renderer='kotti_jsonp',
+             request_method='POST', permission='view', http_cache=0)
+class OperationsView(BaseRestView):
+    """ The ``@@operations-json`` view, see the module's documentation.
+    """
+
+    def __call__(self):
+        try:
+            operations = self.request.json_body[OPERATIONS_KEY]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPBadRequest()
+
+        applier = Operations(self.context, self.request)
+        nodes = list()
+        for index, operation in enumerate(operations):
+            try:
+                nodes.append(applier.apply(operation))
+            except OperationError as e:
+                transaction.doom()
+                raise _error(e.error_class, index, e.detail)
+        DBSession.flush()
+
+        results = list()
+        for node in nodes:
+            if node is None:
+                results.append(dict())
+            else:
+                document = serialize(node, self.request, relmeta=False,
+                                     include_messages=False)
+                results.append(dict(data=document['data']))
+        return {RESULTS_KEY: results}
+
+
+def includeme(config):
+    config.scan(__name__)
@@ -31,8 +31,14 @@ response
 TODO: handle permissions/security
 """
 
+from kotti import DBSession
+from kotti.filedepot import StoredFileResponse
 from kotti.resources import Content, Document, File #, IImage
 from kotti.resources import Image
+from kotti.resources import Node
+from kotti.security import ROLES
+from kotti.security import USER_MANAGEMENT_ROLES
+from kotti.security import get_principals
 from kotti.util import _
 from kotti.util import title_to_name
 
@@ -41,19 +47,47 @@ from kotti.views.edit.actions import NodeActions
 from kotti.views.users import UsersManage
 from kotti.views.users import principal_schema, user_schema, group_schema
 
+from pyramid.encode import urlencode
+from pyramid.exceptions import ConfigurationError
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPCreated
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPNoContent
 from pyramid.renderers import JSONP, render
+from pyramid.renderers import JSONP_VALID_CALLBACK
+from pyramid.threadlocal import manager
 from pyramid.view import view_config, view_defaults
+from repoze.lru import LRUCache
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from zope.interface import Interface
 import colander
 import datetime
 import decimal
+import hashlib
 import json
+import logging
+import transaction
 import venusian
-
+from collections import OrderedDict
+from functools import partial
+
+from kotti_jsonapi.cache import get_document_cache
+from kotti_jsonapi.messages import get_messages
+from kotti_jsonapi.serializers import CompiledSerializer
+from kotti_jsonapi.serializers import RELMETA_SECTIONS
+from kotti_jsonapi.serializers import REQUEST_SECTIONS
+from kotti_jsonapi.serializers import SITE_SECTIONS
+from kotti_jsonapi.serializers import children_info
+from kotti_jsonapi.serializers import get_relmeta_context
 from kotti_jsonapi.serializers import relational_metadata
+from kotti_jsonapi.security import get_permission_evaluator
+from kotti_jsonapi.security import permits
+from kotti_jsonapi.validators import content_etag
+from kotti_jsonapi.validators import not_modified
+
+log = logging.getLogger(__name__)
 
 bools = dict(true=True, false=False)
 
@@ -73,6 +107,12 @@ class IContentFactory(Interface):
         """ Returns a factory that can construct a new object """
 
 
+class IEagerLoads(Interface):
+    """ The names of the relationships of a content type that are eager
+    loaded when listing objects of that type.
+    """
+
+
 def _schema_factory_name(context=None, type_name=None, name=u'default'):
     """ Returns a named factory name based on either context or type named
     """
@@ -85,12 +125,16 @@ def _schema_factory_name(context=None, type_name=None, name=u'default'):
     return u"{0}/{1}".format(type_name, name)
 
 
-def restify(klass, name=u'default'):
+def restify(klass, name=u'default', eager=()):
     """ A decorator to be used to mark a function as a content schema factory.
 
     The decorated function should return a colander schema instance.
 
     It will also register the context klass as a factory for that content.
+
+    ``eager`` names relationships of ``klass`` that serializing it needs.
+    Listings load them for all objects of that type at once, see
+    :func:`eager_load`.
     """
 
     name = _schema_factory_name(context=klass, name=name)
@@ -101,6 +145,11 @@ def restify(klass, name=u'default'):
             config.registry.registerUtility(wrapped, ISchemaFactory, name=name)
             config.registry.registerUtility(klass, IContentFactory,
                                             name=klass.type_info.name)
+            if eager:
+                config.registry.registerUtility(tuple(eager), IEagerLoads,
+                                                name=klass.type_info.name)
+            # compiled serializers may be built from a replaced factory
+            config.registry.pop(SERIALIZERS_KEY, None)
 
         info = venusian.attach(wrapped, callback, category='pyramid')
         return wrapped
@@ -126,21 +175,13 @@ def file_schema_factory(context, request):
     return FileSchema(None)
 
 @restify(Image)
-def file_schema_factory(context, request):
+def image_schema_factory(context, request):
     from kotti.views.edit.content import FileSchema
     return FileSchema(None)
 
 
 ACCEPT = 'application/vnd.api+json'
 
-def get_messages(request):
-    session = request.session
-    return dict(info=session.pop_flash('info'),
-                success=session.pop_flash('success'),
-                error=session.pop_flash('error'),
-                warning=session.pop_flash('warning'),
-                default=session.pop_flash(''))    
-
 class BaseRestView(object):
     """ A generic @@json view for any and all contexts.
 
@@ -165,7 +206,20 @@ class RestView(BaseRestView):
     """
     @view_config(request_method='GET', permission='view')
     def get(self):
-        return self.context
+        response = not_modified(self.context, self.request)
+        if response is not None:
+            return response
+        document = cached_serialize(self.context, self.request,
+                                    etag=self.request.response.etag)
+        include = get_includes(self.request)
+        if include:
+            included, linkage = get_included(self.context, self.request,
+                                             include)
+            data = document['data']
+            relationships = dict(data.get('relationships', {}), **linkage)
+            document = dict(document, included=included,
+                            data=dict(data, relationships=relationships))
+        return document
 
     @view_config(request_method='POST', permission='edit')
     def post(self):
@@ -174,13 +228,8 @@ class RestView(BaseRestView):
         assert data['id'] == self.context.name
         assert data['type'] == self.context.type_info.name
 
-        schema = get_schema(self.context, self.request)
-        validated = schema.deserialize(data['attributes'])
-
-        for k, v in validated.items():
-            setattr(self.context, k, v)
-
-        return self.context
+        return update_content(self.context, self.request, data,
+                              partial=False)
 
     @view_config(request_method='PATCH', permission='edit')
     def patch(self):
@@ -189,34 +238,13 @@ class RestView(BaseRestView):
         assert data['id'] == self.context.name
         assert data['type'] == self.context.type_info.name
 
-        schema = get_schema(self.context, self.request)
-        validated = schema.deserialize(data['attributes'])
-        attrs = dict((k, v) for k, v in validated.items()
-                     if k in data['attributes'])
-        for k, v in attrs.items():
-            setattr(self.context, k, v)
-
-        return self.context
+        return update_content(self.context, self.request, data)
 
     @view_config(request_method='PUT')
     def put(self):
         # we never accept id, it doesn't conform to jsonapi format
         data = self.request.json_body['data']
-
-        klass = get_content_factory(self.request, data['type'])
-
-        add_permission = klass.type_info.add_permission
-        if not self.request.has_permission(add_permission, self.context):
-            raise HTTPForbidden()
-
-        schema_name = _schema_factory_name(type_name=data['type'])
-        schema_factory = self.request.registry.getUtility(ISchemaFactory,
-                                                          name=schema_name)
-        schema = schema_factory(None, self.request)
-        validated = schema.deserialize(data['attributes'])
-
-        name = title_to_name(validated['title'], blacklist=self.context.keys())
-        new_item = self.context[name] = klass(**validated)
+        new_item = create_content(self.context, self.request, data)
 
         response = HTTPCreated()
         response.body = render('kotti_jsonp', new_item, self.request)
@@ -231,6 +259,103 @@ class RestView(BaseRestView):
         return HTTPNoContent()
 
 
+class ChildNames(object):
+    """ The names of the children of ``parent``.
+
+    Instead of loading all the names, they're looked up with queries on the
+    ``(parent_id, name)`` index.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+
+    def __contains__(self, name):
+        if self.parent.id is None:
+            # a new parent, its children are all in memory
+            return name in self.parent.keys()
+        return DBSession.query(Node.id).filter(
+            Node.parent_id == self.parent.id,
+            Node.name == name).first() is not None
+
+    def max_suffix(self, name):
+        """ Returns the highest ``<n>`` of the names ``<name>-<n>``, ``0`` if
+        there are none.
+        """
+        prefix = name + u'-'
+        if self.parent.id is None:
+            suffixes = [key[len(prefix):] for key in self.parent.keys()
+                        if key.startswith(prefix)]
+            return max([int(suffix) for suffix in suffixes
+                        if suffix.isdigit()] or [0])
+
+        pattern = prefix.replace(u'\\', u'\\\\').replace(
+            u'%', u'\\%').replace(u'_', u'\\_')
+        # without leading zeros, the longest and then greatest numeric
+        # suffix is the highest: it's usually the first row
+        query = DBSession.query(Node.name).filter(
+            Node.parent_id == self.parent.id,
+            Node.name.like(pattern + u'%', escape=u'\\'),
+            ~Node.name.like(pattern + u'0%', escape=u'\\')).order_by(
+            func.length(Node.name).desc(), Node.name.desc())
+        for row in query.yield_per(NAMES_BATCH_SIZE):
+            suffix = row.name[len(prefix):]
+            if suffix.isdigit():
+                return int(suffix)
+        return 0
+
+
+NAMES_BATCH_SIZE = 10
+
+
+def unique_name(parent, title):
+    """ Returns a name for a new child of ``parent`` from its ``title``.
+
+    If the name is taken, it gets the suffix following the highest of the
+    ``<name>-<n>`` siblings, found with one query.
+    """
+    name = title_to_name(title)
+    names = ChildNames(parent)
+    if name not in names:
+        return name
+    return u'{0}-{1}'.format(name, names.max_suffix(name) + 1)
+
+
+def create_content(parent, request, data):
+    """ Adds a child to ``parent`` from the JSONAPI resource object ``data``,
+    if the type's add permission is granted.
+    """
+    klass = get_content_factory(request, data['type'])
+
+    add_permission = klass.type_info.add_permission
+    if not request.has_permission(add_permission, parent):
+        raise HTTPForbidden()
+
+    schema_name = _schema_factory_name(type_name=data['type'])
+    schema_factory = request.registry.getUtility(ISchemaFactory,
+                                                 name=schema_name)
+    schema = schema_factory(None, request)
+    validated = schema.deserialize(data['attributes'])
+
+    name = unique_name(parent, validated['title'])
+    new_item = parent[name] = klass(**validated)
+    return new_item
+
+
+def update_content(obj, request, data, partial=True):
+    """ Sets the attributes of the JSONAPI resource object ``data`` on
+    ``obj``. Unless ``partial`` is false, only the attributes present in
+    ``data`` are set.
+    """
+    schema = get_schema(obj, request)
+    validated = schema.deserialize(data['attributes'])
+    if partial:
+        validated = dict((k, v) for k, v in validated.items()
+                         if k in data['attributes'])
+    for k, v in validated.items():
+        setattr(obj, k, v)
+    return obj
+
+
 def get_schema(obj, request, name=u'default'):
     factory_name = _schema_factory_name(context=obj, name=name)
     schema_factory = request.registry.getUtility(ISchemaFactory,
@@ -241,16 +366,177 @@ def get_schema(obj, request, name=u'default'):
 def get_content_factory(request, name):
     return request.registry.getUtility(IContentFactory, name=name)
 
-# def filter_schema(schema, allowed_fields):
-#     """ Filters a schema to include only allowed fields
-#     """
-#
-#     cloned = schema.__class__(self.typ)
-#     cloned.__dict__.update(schema.__dict__)
-#     cloned.children = [node.clone() for node in self.children
-#                        if node.name in allowed_fields]
-#     return cloned
-#
+SERIALIZERS_KEY = 'kotti_jsonapi.serializers'
+
+
+def _get_compiled(registry, key, schema_factory):
+    cache = registry.get(SERIALIZERS_KEY)
+    if cache is None:
+        cache = registry[SERIALIZERS_KEY] = dict()
+    serializer = cache.get(key)
+    if serializer is None:
+        serializer = cache[key] = CompiledSerializer(schema_factory())
+    return serializer
+
+
+def get_serializer(obj, request, name=u'default'):
+    """ Returns the :class:`~kotti_jsonapi.serializers.CompiledSerializer`
+    for the schema of ``obj``.
+
+    It's built once per schema factory and kept in the registry, so the
+    schema factories must not vary their schema by context or request.
+    """
+    factory_name = _schema_factory_name(context=obj, name=name)
+    return _get_compiled(request.registry, factory_name,
+                         lambda: get_schema(obj, request, name))
+
+
+def get_metadata_serializer(request):
+    """ Returns the compiled serializer for :class:`MetadataSchema`.
+    """
+    return _get_compiled(request.registry, MetadataSchema, MetadataSchema)
+
+
+def _split_fields(value):
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+
+def get_fieldsets(request):
+    """ Extracts the sparse fieldsets from the request.
+
+    These are JSONAPI's ``fields[<type name>]=title,description``, which
+    limit the attributes serialized for objects of that type, and the
+    ``meta=state,path`` and ``relmeta=breadcrumbs,has_permission``
+    selectors for the ``meta`` and ``relationships.meta`` sections.
+    A ``None`` value means no restriction. ``chrome=false`` leaves the
+    site level sections (:data:`SITE_SECTIONS`) out of ``relationships.meta``.
+    """
+    params = request.params
+    fields = dict()
+    for key, value in params.items():
+        if key.startswith('fields[') and key.endswith(']'):
+            fields[key[len('fields['):-1]] = set(_split_fields(value))
+
+    meta = params.get('meta')
+    if meta is not None:
+        meta = set(_split_fields(meta))
+
+    relmeta = params.get('relmeta')
+    if relmeta is not None:
+        relmeta = _split_fields(relmeta)
+        if [n for n in relmeta if n not in RELMETA_SECTIONS]:
+            raise HTTPBadRequest()
+
+    chrome = params.get('chrome', 'true').lower()
+    if chrome not in bools:
+        raise HTTPBadRequest()
+
+    return dict(fields=fields, meta=meta, relmeta=relmeta,
+                chrome=bools[chrome])
+
+
+INCLUDES = ('children', 'parent', 'children.children')
+
+
+def get_includes(request):
+    """ Extracts the JSONAPI ``include=children,parent`` parameter from the
+    request, see :data:`INCLUDES` for the supported relationships.
+    """
+    include = request.params.get('include')
+    if not include:
+        return set()
+    include = set(_split_fields(include))
+    if include - set(INCLUDES):
+        raise HTTPBadRequest()
+    return include
+
+
+def preload_children(nodes):
+    """ Loads the children of all ``nodes`` with a single query, so that
+    their ``children`` don't have to be loaded one by one.
+    """
+    nodes = [node for node in nodes if node.id is not None and
+             '_children' not in node.__dict__]
+    if not nodes:
+        return
+    by_parent = dict((node.id, []) for node in nodes)
+    query = Node.query.filter(Node.parent_id.in_(list(by_parent)))
+    for child in query.order_by(Node.parent_id, Node.position):
+        by_parent[child.parent_id].append(child)
+    for node in nodes:
+        set_committed_value(node, '_children', by_parent[node.id])
+
+
+def eager_load(nodes, request):
+    """ Loads what serializing ``nodes`` needs with a constant number of
+    queries: their children (for their links) and the relationships
+    declared with ``restify(..., eager=...)`` for their types.
+    """
+    preload_children(nodes)
+    by_type = OrderedDict()
+    for node in nodes:
+        by_type.setdefault(type(node), []).append(node)
+    for klass, group in by_type.items():
+        type_info = getattr(klass, 'type_info', None)
+        if type_info is None:
+            continue
+        names = request.registry.queryUtility(IEagerLoads,
+                                              name=type_info.name)
+        if not names:
+            continue
+        options = [selectinload(getattr(klass, n)) for n in names]
+        # populates the relationships of the already loaded objects
+        DBSession.query(klass).filter(
+            klass.id.in_([node.id for node in group])).options(*options).all()
+
+
+def _identifier(node):
+    return dict(type=node.type_info.name, id=node.__name__)
+
+
+def get_included(obj, request, include):
+    """ Returns the JSONAPI ``included`` resources of ``obj`` for the
+    relationships in ``include``, and the ``relationships`` of ``obj``
+    linking to them.
+
+    Each level is loaded with a constant number of queries (see
+    :func:`eager_load`). Included resources don't have relational
+    metadata; included children link to their included children.
+    """
+    def resource(node):
+        document = serialize(node, request, relmeta=False,
+                             include_messages=False)
+        return dict(document['data'], meta=document['meta'])
+
+    included = list()
+    relationships = dict()
+    parent = obj.__parent__
+    if 'parent' in include:
+        if parent is None:
+            relationships['parent'] = dict(data=None)
+        elif permits('view', parent, request):
+            included.append(resource(parent))
+            relationships['parent'] = dict(data=_identifier(parent))
+
+    if include & set(['children', 'children.children']):
+        preload_children([obj])
+        children = children_info(obj, request).children
+        eager_load(children, request)
+        relationships['children'] = dict(
+            data=[_identifier(child) for child in children])
+        resources = [resource(child) for child in children]
+        if 'children.children' in include:
+            grandchildren = list()
+            for child, child_resource in zip(children, resources):
+                permitted = children_info(child, request).children
+                child_resource['relationships'] = dict(children=dict(
+                    data=[_identifier(node) for node in permitted]))
+                grandchildren.extend(permitted)
+            eager_load(grandchildren, request)
+            resources.extend(resource(node) for node in grandchildren)
+        included.extend(resources)
+    return included, relationships
+
 
 class MetadataSchema(colander.MappingSchema):
     """ Schema that exposes some metadata information about a content
@@ -299,6 +585,70 @@ class MetadataSchema(colander.MappingSchema):
     #)
 
 
+def _increasing_subsequence(values):
+    """ Returns the indexes of a longest strictly increasing subsequence of
+    ``values``.
+    """
+    tails = list()  # index of the last item of the best run of each length
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        low, high = 0, len(tails)
+        while low < high:
+            middle = (low + high) // 2
+            if values[tails[middle]] < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low:
+            previous[index] = tails[low - 1]
+        if low == len(tails):
+            tails.append(index)
+        else:
+            tails[low] = index
+    result = list()
+    index = tails[-1] if tails else None
+    while index is not None:
+        result.append(index)
+        index = previous[index]
+    return result[::-1]
+
+
+def reorder_positions(order, positions):
+    """ Returns new positions for the node ids in ``order``, given their
+    current ``positions``, changing as few of them as possible.
+
+    The nodes of a longest run already in increasing position keep their
+    positions; the others get the positions following the previous kept
+    node. Where there isn't room, the neighbouring kept nodes are
+    renumbered along with them. The positions stay between ``0`` and the
+    highest of ``len(order) - 1`` and the current positions.
+    """
+    current = [positions[i] for i in order]
+    high = max(current + [len(order) - 1]) + 1
+
+    def room(start, end):
+        low = current[start] if start != -1 else -1
+        top = current[end] if end != len(order) else high
+        return top - low - 1 >= end - start - 1
+
+    kept = list()
+    for index in _increasing_subsequence(current):
+        if room(kept[-1] if kept else -1, index):
+            kept.append(index)
+    while kept and not room(kept[-1], len(order)):
+        kept.pop()
+
+    new = dict()
+    bounds = [-1] + kept + [len(order)]
+    for start, end in zip(bounds, bounds[1:]):
+        low = current[start] if start != -1 else -1
+        for offset, index in enumerate(range(start + 1, end)):
+            new[order[index]] = low + offset + 1
+    for index in kept:
+        new[order[index]] = current[index]
+    return new
+
+
 @view_defaults(permission='edit', http_cache=0, renderer='json')
 class JSONNodeActions(NodeActions):
     @view_config(name='copyjson')
@@ -319,51 +669,216 @@ class JSONNodeActions(NodeActions):
         return dict(result=response, meta=meta)
         
     
+    @view_config(name='reorder-json', request_method='POST')
+    def reorder(self):
+        """ Moves the children whose ids are posted as ``children`` so
+        that they're in that order, starting at index ``position`` (``0``
+        by default) among the other children.
+
+        Returns the new order, with the children's positions.
+        """
+        try:
+            body = self.request.json_body
+            ids = [int(i) for i in body['children']]
+            position = int(body.get('position', 0))
+        except (ValueError, KeyError, TypeError):
+            raise HTTPBadRequest()
+
+        rows = DBSession.query(Node.id, Node.name, Node.position).filter(
+            Node.parent_id == self.context.id).order_by(Node.position).all()
+        if len(set(ids)) != len(ids) or \
+                set(ids) - set(row.id for row in rows):
+            raise HTTPBadRequest()
+        moved = set(ids)
+        others = [row.id for row in rows if row.id not in moved]
+        position = max(0, min(position, len(others)))
+        order = others[:position] + ids + others[position:]
+
+        old = dict((row.id, row.position) for row in rows)
+        new = reorder_positions(order, old)
+        changed = [i for i in order if new[i] != old[i]]
+        if changed:
+            for child in Node.query.filter(Node.id.in_(changed)):
+                child.position = new[child.id]
+            DBSession.expire(self.context, ['_children'])
+
+        names = dict((row.id, row.name) for row in rows)
+        result = [dict(id=i, name=names[i], position=new[i]) for i in order]
+        meta = dict(messages=get_messages(self.request))
+        return dict(result=result, meta=meta)
+
     def _selected_children(self, add_context=True):
         postdata = self.request.json
         #import pdb ; pdb.set_trace()
         return [int(c) for c in postdata['children']]
 
 
+AVATAR_CACHE_SIZE = 10000
+_avatar_urls = LRUCache(AVATAR_CACHE_SIZE)
+
+
+def avatar_url(principal, size="14", default_image='identicon'):
+    """ The same gravatar URL as ``TemplateAPI.avatar_url``, memoized by
+    email (or name, for principals without one).
+    """
+    email = principal.email or principal.name
+    key = (email, str(size), default_image)
+    url = _avatar_urls.get(key)
+    if url is None:
+        digest = hashlib.md5(email.encode('utf-8')).hexdigest()
+        query = {'default': default_image, 'size': str(size)}
+        url = u'https://secure.gravatar.com/avatar/{0}?{1}'.format(
+            digest, urlencode(query))
+        _avatar_urls.put(key, url)
+    return url
+
+
+def list_principals_groups(principals):
+    """ Returns the ``(groups, inherited)`` tuples of ``principals``, like
+    :func:`kotti.security.list_groups_ext` without a context, keyed by name.
+
+    The groups of the groups are loaded with one query per level of nesting
+    for all the principals, instead of one query per group and principal.
+    """
+    factory = get_principals().factory
+    groups_of = dict((p.name, set(p.groups or ())) for p in principals)
+    pending = set().union(*groups_of.values()) - set(groups_of)
+    while pending:
+        names = [name for name in pending if not name.startswith('role:')]
+        for name in pending:
+            groups_of[name] = set()
+        if names:
+            for name, groups in DBSession.query(
+                    factory.name, factory.groups).filter(
+                    factory.name.in_(names)):
+                groups_of[name] = set(groups or ())
+        pending = set().union(*[groups_of[name] for name in pending]) - \
+            set(groups_of)
+
+    result = dict()
+    for principal in principals:
+        groups = set(groups_of[principal.name])
+        inherited = set()
+        seen = set([principal.name]) | groups
+        stack = list(groups - set([principal.name]))
+        while stack:
+            parents = groups_of.get(stack.pop(), set())
+            groups.update(parents)
+            inherited.update(parents)
+            stack.extend(parents - seen)
+            seen.update(parents)
+        result[principal.name] = (list(groups), list(inherited))
+    return result
+
+
+def search_principals_page(request, page):
+    """ Loads one page of the principals matching the ``query`` (or
+    ``filter[query]``) parameter, ordered by name.
+
+    Searching, counting and paging happen in the database. Like
+    :func:`page_children`, ``page['after']`` is the name of the last
+    principal of the previous page.
+    """
+    principals = get_principals()
+    text = request.params.get('filter[query]',
+                              request.params.get('query', u''))
+    if text:
+        text = u'*{0}*'.format(text)
+        query = principals.search(name=text, title=text, email=text)
+    else:
+        query = DBSession.query(principals.factory)
+    total = query.count()
+    factory = principals.factory
+    query = query.order_by(factory.name)
+    if page['after'] is not None:
+        query = query.filter(factory.name > page['after'])
+    else:
+        query = query.offset(page['offset'])
+    found = query.limit(page['limit'] + 1).all()
+    has_more = len(found) > page['limit']
+    found = found[:page['limit']]
+    return dict(principals=found, total=total, has_more=has_more)
+
+
 @view_config(name="setup-users-json", permission="admin",
              root_only=True, renderer="kotti_jsonp", http_cache=0)
 class JSONUsersManage(UsersManage):
+    """ Without search or page parameters in a ``GET`` request, this is
+    kotti's ``@@setup-users`` view as JSON.
+
+    With ``query`` (or ``filter[query]``) or any of the ``page[offset]``,
+    ``page[limit]`` and ``page[after]`` parameters, it returns one page of
+    the matching principals and their groups.
+    """
+
     def __call__(self):
+        if self.request.method == 'GET' and any(
+                key in self.request.params
+                for key in ('query', 'filter[query]', 'page[offset]',
+                            'page[limit]', 'page[after]')):
+            return self.search()
         data = super(JSONUsersManage, self).__call__()
+        if self.request.is_response(data):
+            return data
         data['available_roles'] = [dict(name=r.name, title=r.title)
                                    for r in data['available_roles']]
-        parsed_entries = list()
-        for principal, groups in data['entries']:
-        #for ptuple in data['entries']:
-            #@import pdb ; pdb.set_trace()
-            pdata = dict(name=principal.name,
-                         title=principal.title,
-                         email=principal.email,
-                         avatar_url=data['api'].avatar_url(principal))
-            enabled, disabled = groups
-            parsed_entries.append(dict(principal=pdata, enabled=enabled,
-                                       disabled=disabled))
-        data['entries'] = parsed_entries
+        data['entries'] = [self._entry(principal, groups)
+                           for principal, groups in data['entries']]
         del data['api']
         messages = get_messages(self.request)
         meta = dict(messages=messages)
         return dict(data=data, meta=meta)
-    
+
+    def _entry(self, principal, groups):
+        pdata = dict(name=principal.name,
+                     title=principal.title,
+                     email=principal.email,
+                     avatar_url=avatar_url(principal))
+        enabled, disabled = groups
+        return dict(principal=pdata, enabled=enabled, disabled=disabled)
+
+    def search(self):
+        page = get_page_params(self.request) or dict(
+            offset=0, limit=DEFAULT_PAGE_LIMIT, after=None)
+        result = search_principals_page(self.request, page)
+        principals = result['principals']
+        groups = list_principals_groups(principals)
+        available_roles = [dict(name=ROLES[name].name, title=ROLES[name].title)
+                           for name in USER_MANAGEMENT_ROLES]
+        data = dict(available_roles=available_roles,
+                    entries=[self._entry(principal, groups[principal.name])
+                             for principal in principals])
+
+        links = page_links(self.request, page, dict(
+            children=principals, has_more=result['has_more'],
+            scanned=len(principals)),
+            after=principals[-1].name if principals else None)
+        meta = dict(messages=get_messages(self.request),
+                    total=result['total'])
+        return dict(data=data, meta=meta, links=links)
+
+
 @view_defaults(name='contents-json', accept=ACCEPT, renderer="kotti_jsonp",
                http_cache=0)
 class NodeContents(BaseRestView):
     @view_config(request_method='GET', permission='view')
     def get(self):
         #return self.context
+        response = not_modified(self.context, self.request, levels=2)
+        if response is not None:
+            return response
+        page = get_page_params(self.request)
+        if page is not None:
+            return self._get_page(page)
         obj = self.context
         children = list()
-        index = 0
-        for child in obj.children_with_permission(self.request):
+        permitted = children_info(obj, self.request).children
+        eager_load(permitted, self.request)
+        for child in permitted:
             #cdata = render('kotti_jsonp', child, request=self.request)
             #import pdb ; pdb.set_trace()
             cdata = serialize(child, self.request, include_messages=False)
-            cdata['meta']['position'] = index
-            index += 1
+            cdata['meta']['position'] = child.position
             #print "CDATA", cdata
             #import pdb ; pdb.set_trace()
             #import cPickle as Pickle
@@ -375,19 +890,257 @@ class NodeContents(BaseRestView):
         messages = get_messages(self.request)
         meta = dict(messages=messages)
         return dict(data=children, meta=meta)
-    
 
+    @view_config(request_method='GET', permission='view',
+                 request_param='stream')
+    def stream(self):
+        """ Streams the unpaginated listing: the response body is produced
+        child by child while it's being sent, see :func:`stream_children`.
+        """
+        if get_page_params(self.request) is not None:
+            return self.get()
+        response = not_modified(self.context, self.request, levels=2)
+        if response is not None:
+            return response
+        meta = dict(messages=get_messages(self.request))
+        callback = self.request.GET.get(jsonp.param_name)
+        content_type = 'application/json'
+        if callback is not None:
+            if not JSONP_VALID_CALLBACK.match(callback):
+                raise HTTPBadRequest('Invalid JSONP callback function name.')
+            content_type = 'application/javascript'
+        response = self.request.response
+        response.content_type = content_type
+        response.charset = 'utf-8'
+        response.app_iter = stream_children(self.context, self.request, meta,
+                                            callback=callback)
+        return response
+
+    def _get_page(self, page):
+        result = page_children(self.context, self.request, **page)
+        children = list()
+        eager_load(result['children'], self.request)
+        for child in result['children']:
+            cdata = serialize(child, self.request, include_messages=False)
+            cdata['meta']['position'] = child.position
+            children.append(cdata)
+        messages = get_messages(self.request)
+        meta = dict(messages=messages, total=result['total'])
+        links = page_links(self.request, page, result, after=(
+            result['children'][-1].__name__ if result['children'] else None))
+        return dict(data=children, meta=meta, links=links)
+
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+
+
+def get_page_params(request):
+    """ Extracts the JSONAPI ``page[offset]``, ``page[limit]`` and
+    ``page[after]`` parameters from the request.
+
+    Returns ``None`` if the request doesn't ask for a page.
+    """
+    params = request.params
+    if not any(key in params
+               for key in ['page[offset]', 'page[limit]', 'page[after]']):
+        return None
+    try:
+        offset = int(params.get('page[offset]', 0))
+        limit = int(params.get('page[limit]', DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise HTTPBadRequest()
+    if offset < 0 or limit < 1:
+        raise HTTPBadRequest()
+    return dict(offset=offset, limit=min(limit, MAX_PAGE_LIMIT),
+                after=params.get('page[after]') or None)
+
+
+def page_children(context, request, offset=0, limit=DEFAULT_PAGE_LIMIT,
+                  after=None, permission='view'):
+    """ Loads one page of the children of ``context`` that are accessible
+    with ``permission``.
+
+    Offset, limit and the ``after`` cursor (the name of the last child of
+    the previous page) are applied in the query, so only the rows of the
+    requested page are loaded. Children that aren't permitted are skipped
+    and replaced with rows from further down, which is why the result also
+    carries the number of ``scanned`` rows. The ``total`` only counts
+    the permitted children.
+    """
+    query = Node.query.filter(Node.parent_id == context.id)
+    evaluator = get_permission_evaluator(context, request)
+    total = evaluator.count_children(permission)
+
+    if after is not None:
+        position = DBSession.query(Node.position).filter(
+            Node.parent_id == context.id, Node.name == after).scalar()
+        if position is None:
+            raise HTTPBadRequest()
+        query = query.filter(Node.position > position)
+        offset = 0
+    query = query.order_by(Node.position)
+
+    children = list()
+    scanned = 0
+    has_more = True
+    while has_more and len(children) < limit:
+        wanted = limit - len(children)
+        batch = query.offset(offset + scanned).limit(wanted).all()
+        scanned += len(batch)
+        children.extend(evaluator.filter(batch, permission))
+        has_more = len(batch) == wanted
+    if has_more:
+        has_more = query.with_entities(Node.id).offset(
+            offset + scanned).first() is not None
+
+    return dict(children=children, total=total, scanned=scanned,
+                has_more=has_more)
+
+
+STREAM_BATCH_SIZE = 100
+
+
+def iter_children(context, request, batch_size=STREAM_BATCH_SIZE,
+                  permission='view'):
+    """ Yields the children of ``context`` that have ``permission``, loading
+    them in batches of ``batch_size`` ordered by position.
+    """
+    evaluator = get_permission_evaluator(context, request)
+    query = Node.query.filter(Node.parent_id == context.id).order_by(
+        Node.position)
+    position = None
+    while True:
+        batch_query = query
+        if position is not None:
+            batch_query = query.filter(Node.position > position)
+        batch = batch_query.limit(batch_size).all()
+        batch_children = evaluator.filter(batch, permission)
+        eager_load(batch_children, request)
+        for child in batch_children:
+            yield child
+        if len(batch) < batch_size:
+            break
+        position = batch[-1].position
+
+
+def stream_children(context, request, meta, callback=None):
+    """ Yields the ``@@contents-json`` document of ``context`` in chunks of
+    UTF-8 encoded JSON, one per batch of children, so that the whole listing
+    is never held in memory.
+
+    The body is sent after the view returned, so the current request is
+    made available again while serializing, and the context is looked up
+    by id in case the request's transaction has ended. If it has (the
+    request was finished before the body was sent), the transaction begun
+    by the queries of the listing is ended too, so that the connection goes
+    back to the pool.
+    """
+    finished = []
+    request.add_finished_callback(lambda request: finished.append(True))
+    return _stream_children(context, request, meta, callback, finished)
+
+
+def _stream_children(context, request, meta, callback, finished):
+    registry = request.registry
+    encode = partial(jsonp.serializer, default=jsonp._make_default(request),
+                     **jsonp.kw)
+    context_id = context.id
+    prefix = u'{"data": ['
+    if callback is not None:
+        prefix = u'/**/{0}({1}'.format(callback, prefix)
+
+    manager.push(dict(request=request, registry=registry))
+    try:
+        context = DBSession.query(Node).get(context_id)
+        chunk = [prefix]
+        index = 0
+        for child in iter_children(context, request):
+            cdata = serialize(child, request, include_messages=False)
+            cdata['meta']['position'] = child.position
+            if index:
+                chunk.append(u', ')
+            chunk.append(encode(cdata))
+            index += 1
+            if index % STREAM_BATCH_SIZE == 0:
+                yield u''.join(chunk).encode('utf-8')
+                chunk = []
+        chunk.append(u'], "meta": {0}}}'.format(encode(meta)))
+        if callback is not None:
+            chunk.append(u');')
+        yield u''.join(chunk).encode('utf-8')
+    finally:
+        if finished:
+            transaction.abort()
+        manager.pop()
+
+
+def page_links(request, page, result, after=None):
+    """ JSONAPI pagination links for a result of :func:`page_children`.
+    ``after`` is the cursor of the result's last item, for the next link
+    when paginating with ``page[after]``.
+    """
+
+    def link(**kw):
+        params = dict((k, v) for k, v in request.GET.items()
+                      if not k.startswith('page['))
+        params['page[limit]'] = page['limit']
+        for key, value in kw.items():
+            params['page[{0}]'.format(key)] = value
+        return '{0}?{1}'.format(request.path_url, urlencode(params))
+
+    links = dict(self=request.url, next=None, prev=None)
+    if page['after'] is not None:
+        if result['has_more']:
+            links['next'] = link(after=after)
+        links['first'] = link(offset=0)
+        return links
+
+    if result['has_more']:
+        links['next'] = link(offset=page['offset'] + result['scanned'])
+    if page['offset'] > 0:
+        links['prev'] = link(offset=max(page['offset'] - page['limit'], 0))
+    return links
+
+
+def relmeta_sections(request, chrome=None):
+    """ Returns the names of the ``relationships.meta`` sections asked for
+    by the request, see :func:`get_fieldsets`. ``chrome`` overrides the
+    request's ``chrome`` parameter.
+    """
+    fieldsets = get_fieldsets(request)
+    sections = fieldsets['relmeta']
+    if sections is None:
+        sections = list(RELMETA_SECTIONS)
+    if chrome is None:
+        chrome = fieldsets['chrome']
+    if not chrome:
+        sections = [name for name in sections if name not in SITE_SECTIONS]
+    return sections
 
 
 def serialize(obj, request, name=u'default', relmeta=True,
-              include_messages=True):
+              include_messages=True, chrome=None):
     """ Serialize a Kotti content item.
 
     The response JSON conforms with JSONAPI standard.
 
-    TODO: implement JSONAPI filtering and pagination.
+    Pagination of listings is handled by :class:`NodeContents`. Sparse
+    fieldsets (see :func:`get_fieldsets`) are applied before serializing,
+    so fields and sections that weren't asked for aren't computed at all.
+    The schemas are serialized with serializers compiled once per type,
+    see :func:`get_serializer`.
+
+    With ``chrome=False`` the site level sections (:data:`SITE_SECTIONS`),
+    served by ``@@chrome-json``, are left out of ``relationships.meta``. By
+    default the request's ``chrome`` parameter decides.
+
+    TODO: implement JSONAPI filtering.
     """
-    data = get_schema(obj, request, name).serialize(obj.__dict__)
+    fieldsets = get_fieldsets(request)
+    fields = fieldsets['fields'].get(obj.type_info.name)
+
+    data = get_serializer(obj, request, name)(obj.__dict__, fields)
     # FIXME
     data['oid'] = obj.id
 
@@ -402,26 +1155,198 @@ def serialize(obj, request, name=u'default', relmeta=True,
     res['id'] = obj.__name__
     res['attributes'] = data
     res['links'] = {
-        'self': request.resource_url(obj),
-        'children': [request.resource_url(child)
-                     for child in obj.children_with_permission(request)]
+        'self': get_relmeta_context(obj, request).location(obj)['url'],
     }
-    meta = MetadataSchema().serialize(obj.__dict__)
+    if fields is None or 'children' in fields:
+        res['links']['children'] = children_info(obj, request).urls
+    if isinstance(obj, File):
+        # from the columns, the file itself is never loaded
+        for key in FILE_ATTRIBUTES:
+            if fields is None or key in fields:
+                data[key] = getattr(obj, key)
+        res['links']['download'] = request.resource_url(obj, 'download')
+    meta = get_metadata_serializer(request)(obj.__dict__, fieldsets['meta'])
     # FIXME in_navigation is serialized as string instead of bool
-    meta['in_navigation'] = bools[meta['in_navigation'].lower()]
+    if 'in_navigation' in meta:
+        meta['in_navigation'] = bools[meta['in_navigation'].lower()]
     if include_messages:
         meta['messages'] = get_messages(request)
     if relmeta:
         # make data.relationships.meta object
         rel = dict()
-        relmeta = dict()
-        rel['meta'] = relational_metadata(obj, request)
+        rel['meta'] = relational_metadata(
+            obj, request, sections=relmeta_sections(request, chrome))
         res['relationships'] = rel
     
     
     return dict(data=res, meta=meta)
 
 
+def _orjson_serializer():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(value, default=None, **kw):
+        return orjson.dumps(value, default=default,
+                            option=option).decode('utf-8')
+    return dumps
+
+
+def _simplejson_serializer():
+    import simplejson
+    return simplejson.dumps
+
+
+JSON_BACKENDS = OrderedDict([
+    ('orjson', _orjson_serializer),
+    ('simplejson', _simplejson_serializer),
+    ('json', lambda: json.dumps),
+])
+
+
+def json_serializer(backend=None):
+    """ Returns the ``dumps`` function of the JSON ``backend``, as used by
+    the ``serializer`` of pyramid's JSON renderers.
+
+    ``backend`` is one of :data:`JSON_BACKENDS`, or ``auto`` for the first
+    one that's installed. Unavailable backends fall back to the stdlib's
+    ``json``. The renderer's adapters are still used for the objects a
+    backend can't encode natively (orjson encodes dates and times itself,
+    with the same ISO format as the adapters).
+    """
+    backend = (backend or 'json').strip()
+    if backend == 'auto':
+        names = list(JSON_BACKENDS)
+    elif backend in JSON_BACKENDS:
+        names = [backend, 'json']
+    else:
+        raise ConfigurationError(
+            'Unknown kotti_jsonapi.json_backend: {0}'.format(backend))
+    for name in names:
+        try:
+            return JSON_BACKENDS[name]()
+        except ImportError:
+            if backend != 'auto':
+                log.warning('JSON backend %s is not installed, '
+                            'falling back to json', name)
+
+
+FILE_ATTRIBUTES = ('filename', 'mimetype', 'size')
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+
+class RangeFileIter(object):
+    """ Iterates over the blocks of a stored file, from ``start`` up to
+    ``stop``.
+
+    It provides webob's ``app_iter_range``, so that ``Range`` requests seek
+    to the requested bytes instead of reading the file from its start.
+    """
+
+    def __init__(self, f, block_size=DOWNLOAD_BLOCK_SIZE, start=0,
+                 stop=None):
+        self.file = f
+        self.block_size = block_size
+        self.position = start
+        self.stop = stop
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        size = self.block_size
+        if self.stop is not None:
+            size = min(size, self.stop - self.position)
+            if size <= 0:
+                raise StopIteration
+        data = self.file.read(size)
+        if not data:
+            raise StopIteration
+        self.position += len(data)
+        return data
+
+    __next__ = next
+
+    def app_iter_range(self, start, stop):
+        seekable = getattr(self.file, 'seekable', None)
+        if seekable is not None and seekable():
+            self.file.seek(start)
+        else:
+            skipped = 0
+            while skipped < start:
+                data = self.file.read(min(self.block_size, start - skipped))
+                if not data:
+                    break
+                skipped += len(data)
+        return RangeFileIter(self.file, self.block_size, start, stop)
+
+    def close(self):
+        self.file.close()
+
+
+@view_config(name='download', context=File, permission='view',
+             request_method=('GET', 'HEAD'))
+def download(context, request):
+    """ Streams the file of ``context``, with support for conditional and
+    ``Range`` requests. Add ``?inline`` to have it displayed inline instead
+    of as an attachment.
+
+    Only ``Range`` requests are served with a :class:`RangeFileIter`; whole
+    files keep the server's ``wsgi.file_wrapper``, if any.
+    """
+    disposition = 'inline' if 'inline' in request.params else 'attachment'
+    response = StoredFileResponse(context.data.file, request,
+                                  disposition=disposition)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if 'Range' not in request.headers:
+        return response
+    content_length = response.content_length
+    response.app_iter = RangeFileIter(context.data.file)
+    # assigning app_iter resets the content length
+    response.content_length = content_length
+    return response
+
+
+def _with_relmeta(document, relmeta):
+    data = document['data']
+    relationships = dict(data['relationships'], meta=relmeta)
+    return dict(document, data=dict(data, relationships=relationships))
+
+
+def cached_serialize(obj, request, etag=None):
+    """ Like :func:`serialize`, but the document is kept in the
+    :class:`~kotti_jsonapi.cache.DocumentCache`, under its ``etag`` (see
+    :func:`~kotti_jsonapi.validators.content_etag`). The flash messages
+    and the sections that depend on the request's URL
+    (:data:`REQUEST_SECTIONS`) are never cached.
+    """
+    cache = get_document_cache(request.registry)
+    if cache is None or obj.id is None:
+        return serialize(obj, request)
+    if etag is None:
+        etag = content_etag(obj, request)
+    key = cache.key(etag, request)
+    document = cache.get(key)
+    if document is None:
+        document = serialize(obj, request, include_messages=False)
+        relmeta = document['data']['relationships']['meta']
+        document = _with_relmeta(document, dict(
+            (name, value) for name, value in relmeta.items()
+            if name not in REQUEST_SECTIONS))
+        cache.put(key, document)
+
+    sections = [name for name in relmeta_sections(request)
+                if name in REQUEST_SECTIONS]
+    if sections:
+        site_info = get_relmeta_context(obj, request).site_info
+        relmeta = dict(document['data']['relationships']['meta'])
+        for name in sections:
+            relmeta[name] = site_info[name]
+        document = _with_relmeta(document, relmeta)
+    meta = dict(document['meta'], messages=get_messages(request))
+    return dict(document, meta=meta)
+
+
 jsonp = JSONP(param_name='callback')
 jsonp.add_adapter(Content, serialize)
 jsonp.add_adapter(colander._null, lambda obj, req: None)
@@ -433,5 +1358,14 @@ contents_jsonp = JSONP(param_name='callback')
 
 
 def includeme(config):
+    serializer = json_serializer(
+        config.registry.settings.get('kotti_jsonapi.json_backend'))
+    jsonp.serializer = contents_jsonp.serializer = serializer
     config.add_renderer('kotti_jsonp', jsonp)
+    config.include('kotti_jsonapi.cache')
+    config.include('kotti_jsonapi.uploads')
+    config.include('kotti_jsonapi.operations')
+    config.include('kotti_jsonapi.tree')
+    config.include('kotti_jsonapi.chrome')
+    config.include('kotti_jsonapi.urls')
     config.scan(__name__)
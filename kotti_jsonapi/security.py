@@ -0,0 +1,202 @@
+""" Bulk permission checks
+
+Checking a permission with ``request.has_permission`` computes the
+effective principals and walks the ``__acl__`` of every node in the lineage
+of the context, every time. When listing the children of a node, this is
+repeated for each child and each permission, although all children share
+the same ancestors.
+
+:class:`PermissionEvaluator` computes the merged ACL chain and the
+effective principals of a parent node once and evaluates the permissions of
+its children against them. It gives the same answers as pyramid's
+:class:`~pyramid.authorization.ACLAuthorizationPolicy`; with any other
+policy it falls back to ``request.has_permission``.
+"""
+
+import hashlib
+
+from kotti import DBSession
+from kotti.resources import LocalGroup
+from kotti.resources import Node
+from kotti.security import authz_context
+from kotti.util import DontCache
+from kotti.util import request_cache
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.compat import is_nonstr_iter
+from pyramid.decorator import reify
+from pyramid.interfaces import IAuthenticationPolicy
+from pyramid.interfaces import IAuthorizationPolicy
+from pyramid.location import lineage
+from pyramid.security import Allow
+from sqlalchemy import func
+from sqlalchemy import or_
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+def _acl_of(node):
+    try:
+        acl = node.__acl__
+    except AttributeError:
+        return []
+    if acl and callable(acl):
+        acl = acl()
+    return acl or []
+
+
+class PermissionEvaluator(object):
+    """ Evaluates permissions for a ``parent`` node and its children.
+    """
+
+    def __init__(self, parent, request):
+        self.parent = parent
+        self.request = request
+
+    @reify
+    def enabled(self):
+        """ Bulk evaluation is only possible with pyramid's ACL policy.
+        """
+        registry = self.request.registry
+        authn_policy = registry.queryUtility(IAuthenticationPolicy)
+        authz_policy = registry.queryUtility(IAuthorizationPolicy)
+        return (authn_policy is not None and
+                type(authz_policy) is ACLAuthorizationPolicy)
+
+    @reify
+    def acl_chain(self):
+        """ The ACEs of the parent and all its ancestors, in the order
+        they're consulted by the ACL authorization policy.
+        """
+        chain = list()
+        for location in lineage(self.parent):
+            chain.extend(_acl_of(location))
+        return chain
+
+    @reify
+    def principals(self):
+        return self._effective_principals(self.parent)
+
+    def _effective_principals(self, context):
+        # kotti's groupfinder looks up local roles in the authz_context
+        with authz_context(context, self.request):
+            return self.request.effective_principals
+
+    def _is_child(self, context):
+        return getattr(context, '__parent__', None) is self.parent
+
+    def _evaluate(self, acl, principals, permission):
+        for ace_action, ace_principal, ace_permissions in acl:
+            if ace_principal in principals:
+                if not is_nonstr_iter(ace_permissions):
+                    ace_permissions = [ace_permissions]
+                if permission in ace_permissions:
+                    return ace_action == Allow
+        return False
+
+    def permits(self, permission, context):
+        """ Returns ``True`` if ``permission`` is granted on ``context``,
+        which must be the parent or one of its children.
+        """
+        if not self.enabled:
+            return bool(self.request.has_permission(permission, context))
+        if context is self.parent:
+            return self._evaluate(self.acl_chain, self.principals, permission)
+        if not self._is_child(context):
+            return bool(self.request.has_permission(permission, context))
+        acl = list(_acl_of(context)) + self.acl_chain
+        principals = self.principals
+        if context.local_groups:
+            # local roles assigned on the child itself
+            principals = self._effective_principals(context)
+        return self._evaluate(acl, principals, permission)
+
+    def filter(self, children, permission='view'):
+        """ Returns the ``children`` on which ``permission`` is granted.
+        """
+        return [child for child in children
+                if self.permits(permission, child)]
+
+    def count_children(self, permission='view'):
+        """ Returns the number of children of the parent on which
+        ``permission`` is granted.
+
+        Children without an ACL or local roles of their own get the
+        parent's answer, so they're only counted; just the others are
+        loaded and checked.
+        """
+        children = Node.query.filter(Node.parent_id == self.parent.id)
+        if not self.enabled:
+            return len(self.filter(children.all(), permission))
+        own_roles = DBSession.query(LocalGroup.node_id).filter(
+            LocalGroup.node_id == Node.id).exists()
+        special = or_(Node._acl != None, own_roles)  # noqa
+        count = 0
+        if self.permits(permission, self.parent):
+            count = DBSession.query(func.count(Node.id)).filter(
+                Node.parent_id == self.parent.id, ~special).scalar()
+        return count + len(self.filter(children.filter(special).all(),
+                                       permission))
+
+    @reify
+    def _parent_key(self):
+        return (_digest(self.acl_chain), _digest(sorted(self.principals)))
+
+    def permissions_key(self, context):
+        """ Returns a key that's the same for all contexts on which the same
+        permissions are granted, or ``None`` if ``context`` needs its own
+        checks: it isn't the parent or one of its children, has local roles
+        of its own, or the ACL policy isn't used.
+        """
+        if not self.enabled:
+            return None
+        if context is self.parent:
+            return self._parent_key
+        if not self._is_child(context) or context.local_groups:
+            return None
+        acl = _acl_of(context)
+        if not acl:
+            return self._parent_key
+        return (_digest(list(acl)),) + self._parent_key
+
+    def flags(self, context, permissions):
+        """ Returns a dict mapping each of ``permissions`` to whether it's
+        granted on ``context``.
+        """
+        return dict((permission, self.permits(permission, context))
+                    for permission in permissions)
+
+
+def _cachekey_permission_evaluator(parent, request):
+    if parent.id is None:
+        raise DontCache
+    # by identity: a node loaded again (e.g. in a new transaction) isn't
+    # the parent of the old one's children; the cached evaluator keeps the
+    # parent alive, so its id() isn't reused
+    return id(parent)
+
+
+@request_cache(_cachekey_permission_evaluator)
+def get_permission_evaluator(parent, request):
+    """ Returns the :class:`PermissionEvaluator` for ``parent``, shared by
+    all callers in the current request that have the same ``parent``
+    object.
+    """
+    return PermissionEvaluator(parent, request)
+
+
+def evaluator_for(context, request):
+    """ Returns the evaluator of the parent of ``context``, so that checks
+    on siblings share the parent's ACL chain.
+    """
+    parent = getattr(context, '__parent__', None)
+    if parent is None:
+        parent = context
+    return get_permission_evaluator(parent, request)
+
+
+def permits(permission, context, request):
+    """ Checks ``permission`` on ``context`` with :func:`evaluator_for`.
+    """
+    return evaluator_for(context, request).permits(permission, context)
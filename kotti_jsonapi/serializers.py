@@ -1,18 +1,35 @@
+import datetime
 import os
+from collections import OrderedDict
 
+import colander
+
+from kotti import DBSession
+from kotti.resources import Node
 from kotti.util import _
 from kotti.util import LinkParent, LinkRenderer
 
 from kotti.views.util import TemplateAPI
-from kotti.views.edit.actions import workflow as get_workflow
 from kotti.views.edit.actions import actions as get_actions
 from kotti.views.edit.actions import \
     content_type_factories as get_content_type_factories
 from kotti.views.edit.actions import contents_buttons as get_contents_buttons
 
 
+from kotti.util import DontCache
+from kotti.util import request_cache
 from kotti.views.edit.default_views import DefaultViewSelection
+from kotti.views.form import ObjectType
+from pyramid.compat import text_type
+from pyramid.decorator import reify
 from pyramid.interfaces import ILocation
+from pyramid.location import lineage
+
+from kotti_jsonapi.cache import get_site_cache
+from kotti_jsonapi.security import evaluator_for
+from kotti_jsonapi.security import get_permission_evaluator
+from kotti_jsonapi.security import permits
+from kotti_jsonapi.workflows import describe_workflow
 
 
 
@@ -99,74 +116,401 @@ def handle_link_parent(link, context, request, api):
             continue
     return action_links
 
-def relational_metadata(obj, request, get_user=True,
-                        get_type_info=True,
-                        get_permissions=True,
-                        get_extra_info=True):
-    # some of this is just to mimick templates
-    relmeta = dict()
-    api = JSONTemplateAPI(obj, request)
-    if get_user:
-        relmeta['current_user'] = serialize_user(obj, request, api=api)
-
-    if get_type_info:
-        # type info
-        type_info = dict()
-        for attr in ['selectable_default_views', 'title', 'name',
-                     'addable_to', 'add_permission']:
-            type_info[attr] = getattr(obj.type_info, attr)
-        if type_info['name'] == 'Image':
-            for span in ['span1', 'span4']:
-                key = 'image_%s_url' % span
-                type_info[key] = request.resource_url(obj, 'image', span)
-        relmeta['type_info'] = type_info
-
-    if get_permissions:
-        # permissions
-        has_permission = dict()
-        for key in ['add', 'edit', 'state_change']:
-            has_permission[key] = bool(api.has_permission(key).boolval)
-        has_permission['admin'] = bool(
-            api.has_permission('admin', api.root).boolval)
-        relmeta['has_permission'] = has_permission
-        
-
-    if not get_extra_info:
-        return relmeta
-    
+def _converter(node):
+    """ Returns a function that serializes a value like ``node.serialize``
+    does. The common node types get a shortcut that skips colander's
+    generic machinery.
+    """
+    default = node.default
+    if isinstance(default, colander.deferred):
+        default = colander.null
+    typ = node.typ
+
+    if type(node).serialize != colander.SchemaNode.serialize:
+        return node.serialize
+
+    if type(typ) is colander.String and not typ.encoding:
+        def convert(value):
+            if value is colander.null:
+                value = default
+            if value is colander.null:
+                return colander.null
+            return text_type(value)
+        return convert
+
+    if type(typ) is ObjectType:
+        def convert(value):
+            if value is colander.null:
+                return default
+            return value
+        return convert
+
+    if type(typ) is colander.Date:
+        def convert(value):
+            if value is colander.null:
+                value = default
+            if not value:
+                return colander.null
+            if isinstance(value, datetime.datetime):
+                value = value.date()
+            if not isinstance(value, datetime.date):
+                return node.serialize(value)
+            return value.isoformat()
+        return convert
+
+    return node.serialize
+
+
+class CompiledSerializer(object):
+    """ A precompiled version of a colander mapping schema's ``serialize``.
+
+    The schema's children are flattened once into a list of
+    ``(name, converter)`` pairs, which is then applied to the values of
+    an object's ``__dict__``. The output is the same as the schema's.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields = [(node.name, _converter(node),
+                        node.default is colander.drop)
+                       for node in schema.children]
+        self.preserve = getattr(schema.typ, 'unknown', None) == 'preserve'
+
+    def __call__(self, values, fields=None):
+        """ Serializes the ``values`` mapping, limited to ``fields`` if
+        it's not ``None``.
+        """
+        if self.preserve:
+            result = self.schema.serialize(dict(values))
+            if fields is not None:
+                result = dict((k, v) for k, v in result.items()
+                              if k in fields)
+            return result
+        result = dict()
+        for name, convert, drop_null in self.fields:
+            if fields is not None and name not in fields:
+                continue
+            value = values.get(name, colander.null)
+            if value is colander.drop or (value is colander.null and
+                                          drop_null):
+                continue
+            value = convert(value)
+            if value is not colander.drop:
+                result[name] = value
+        return result
+
+
+class ChildrenInfo(object):
+    """ The children of a node that are accessible with a permission,
+    together with their resource paths and URLs.
+    """
+
+    def __init__(self, node, request, permission='view'):
+        self.request = request
+        evaluator = get_permission_evaluator(node, request)
+        self.children = evaluator.filter(node.children, permission)
+
+    @reify
+    def names(self):
+        return [child.__name__ for child in self.children]
+
+    @reify
+    def paths(self):
+        return [self.request.resource_path(child) for child in self.children]
+
+    @reify
+    def urls(self):
+        return [self.request.resource_url(child) for child in self.children]
+
+
+def _cachekey_children_info(node, request, permission='view'):
+    if node.id is None:
+        # not flushed yet, there's nothing to key on
+        raise DontCache
+    return node.id, permission
+
+
+@request_cache(_cachekey_children_info)
+def children_info(node, request, permission='view'):
+    """ Returns the :class:`ChildrenInfo` of ``node``, memoized per request
+    so that the children are queried and checked for permissions only once
+    per node.
+    """
+    return ChildrenInfo(node, request, permission)
+
+
+def _ancestors_loaded(node):
+    """ Tells whether all the ancestors of ``node`` are in the session,
+    so that walking up its lineage doesn't load them one by one.
+    """
+    identity_map = DBSession.identity_map
+    mapper = Node.__mapper__
+    while node.parent_id is not None:
+        node = identity_map.get(
+            mapper.identity_key_from_primary_key((node.parent_id,)))
+        if node is None:
+            return False
+    return True
+
+
+class RelationalMetadataContext(object):
+    """ Request scoped holder for the parts of :func:`relational_metadata`
+    that don't depend on the serialized object.
+
+    When serializing a listing (``@@contents-json``) every child used to
+    rebuild the current user, the navbar and the site setup links. These
+    are now computed once, on first access, and shared by every object
+    serialized in the same request.
+    """
+
+    def __init__(self, context, request):
+        self.request = request
+        self.api = JSONTemplateAPI(context, request)
+        self._navitems = dict()
+        self._ancestry = dict()
+
+    @reify
+    def current_user(self):
+        return serialize_user(self.api.root, self.request, api=self.api)
+
+    @reify
+    def site_info(self):
+        request = self.request
+        api = self.api
+        return dict(
+            application_url=request.application_url,
+            site_title=api.site_title,
+            root_url=api.url(api.root),
+            request_url=request.url,
+            logout_url=api.url(api.root, '@@logout',
+                               query=dict(came_from=request.url)),
+        )
+
+    def cached(self, context, name, compute, *parts):
+        """ Returns ``compute()``, cached across requests by the site cache
+        (see :class:`~kotti_jsonapi.cache.SiteCache`) if it's enabled.
+        """
+        cache = get_site_cache(self.request.registry)
+        if cache is None:
+            return compute()
+        return cache.get_or_compute(context, self.request, name, compute,
+                                    *parts)
+
+    def cached_by(self, key, compute):
+        """ Like :meth:`cached`, with an explicit cache ``key``.
+        """
+        cache = get_site_cache(self.request.registry)
+        if cache is None:
+            return compute()
+        return cache.lookup(key, self.request, compute)
+
+    @reify
+    def site_setup_links(self):
+        # site setup links are always rendered against the root, as in
+        # kotti's own templates; whether a link is selected depends on the
+        # view name
+        api = self.api
+        links = self.cached(api.root, 'site_setup_links',
+                            self._site_setup_links, self.request.view_name)
+        return [dict(link) for link in links]
+
+    def _site_setup_links(self):
+        api = self.api
+        site_setup_links = list()
+        for link in api.site_setup_links:
+            site_setup_links.append(get_link_info(link, api.root,
+                                                  self.request))
+        # FIXME this fixes a problem where a plugin seems to define an
+        # extra settings link
+        site_setup_urls = list()
+        setup_links = list()
+        for link in site_setup_links:
+            if link['url'] not in site_setup_urls:
+                site_setup_urls.append(link['url'])
+                setup_links.append(link)
+        return setup_links
+
+    def ancestry(self, node):
+        """ Returns the ``(node, info)`` pairs of the lineage of ``node``,
+        from the root down to ``node``. ``info`` holds the ``id``, ``name``,
+        ``title``, ``description``, ``url`` and ``path`` of the node.
+
+        The ancestors that weren't seen before in this request are loaded
+        with a single query on their paths.
+        """
+        path = getattr(node, 'path', None)
+        if path is None or getattr(node, 'id', None) is None:
+            # not flushed yet
+            return self._build_ancestry(
+                list(reversed(list(lineage(node)))), [])[-1]
+        if path not in self._ancestry:
+            prefixes = [path[:index + 1]
+                        for index, char in enumerate(path) if char == u'/']
+            missing = [prefix for prefix in prefixes[:-1]
+                       if prefix not in self._ancestry]
+            ancestors = None
+            if missing and not _ancestors_loaded(node):
+                # the parents are then found in the (weak referencing)
+                # identity map while ``ancestors`` holds them
+                ancestors = DBSession.query(Node).filter(
+                    Node.path.in_(missing)).all()
+            chain = list(reversed(list(lineage(node))))
+            del ancestors
+            known = list()
+            for ancestor in chain[:-1]:
+                if ancestor.path not in self._ancestry:
+                    break
+                known = self._ancestry[ancestor.path]
+            for item in self._build_ancestry(chain, known):
+                self._ancestry.setdefault(item[-1][0].path, item)
+        return self._ancestry[path]
+
+    def location(self, node):
+        """ Returns the ``info`` of ``node`` from its :meth:`ancestry`.
+        """
+        return self.ancestry(node)[-1][1]
+
+    def _build_ancestry(self, chain, known):
+        """ Returns the ancestries of the nodes of ``chain`` (from the root
+        down) after the ``known`` ancestry of its first nodes.
+        """
+        # URLs and paths are built from the parent's, see kotti_jsonapi.urls
+        request = self.request
+        result = list()
+        ancestry = list(known)
+        for node in chain[len(known):]:
+            info = dict(id=node.id, name=node.name, title=node.title,
+                        description=getattr(node, 'description', None),
+                        url=request.resource_url(node),
+                        path=request.resource_path(node))
+            ancestry = ancestry + [(node, info)]
+            result.append(ancestry)
+        return result
+
+    def navitems(self, navigation_root):
+        """ The ``(id, item)`` pairs of the top navbar items below
+        ``navigation_root``, without the per object ``inside`` flag.
+        """
+        key = getattr(navigation_root, 'id', None) or id(navigation_root)
+        if key not in self._navitems:
+            self._navitems[key] = self.cached(
+                navigation_root, 'navitems',
+                lambda: self._compute_navitems(navigation_root))
+        return self._navitems[key]
+
+    def _compute_navitems(self, navigation_root):
+        api = self.api
+        navitems = list()
+        for item in api.list_children(navigation_root):
+            if item.in_navigation:
+                navitems.append((item.id, dict(url=api.url(item),
+                                               path=api.path(item),
+                                               description=item.description,
+                                               title=item.title)))
+        return navitems
+
+
+@request_cache(lambda context, request: None)
+def get_relmeta_context(context, request):
+    """ Returns the :class:`RelationalMetadataContext` of the current
+    request, creating it for ``context`` if it doesn't exist yet.
+    """
+    return RelationalMetadataContext(context, request)
+
+
+#: ``relational_metadata`` sections by name, in the order they're computed
+RELMETA_SECTIONS = OrderedDict()
+
+#: sections returned when ``relational_metadata`` is called with
+#: ``get_extra_info=False``
+BASIC_SECTIONS = ('current_user', 'type_info', 'has_permission')
+
+#: the site level sections, the same on every page of the site; they're
+#: served on their own by ``@@chrome-json``
+SITE_SECTIONS = ('current_user', 'application_url', 'site_title', 'root_url',
+                 'logout_url', 'navitems', 'site_setup_links')
+
+#: the sections that depend on the URL of the request, left out of cached
+#: documents
+REQUEST_SECTIONS = ('request_url', 'logout_url')
+
+
+def relmeta_section(name):
+    """ A decorator to register a function as a ``relational_metadata``
+    section. The function is called with the serialized object, the
+    request, a :class:`JSONTemplateAPI` for the object and the request's
+    :class:`RelationalMetadataContext`.
+    """
+    def wrapper(wrapped):
+        RELMETA_SECTIONS[name] = wrapped
+        return wrapped
+    return wrapper
+
+
+@relmeta_section('current_user')
+def _current_user(obj, request, api, shared):
+    return shared.current_user
+
+
+@relmeta_section('type_info')
+def _type_info(obj, request, api, shared):
+    type_info = dict()
+    for attr in ['selectable_default_views', 'title', 'name',
+                 'addable_to', 'add_permission']:
+        type_info[attr] = getattr(obj.type_info, attr)
+    if type_info['name'] == 'Image':
+        for span in ['span1', 'span4']:
+            key = 'image_%s_url' % span
+            type_info[key] = request.resource_url(obj, 'image', span)
+    return type_info
+
+
+@relmeta_section('has_permission')
+def _has_permission(obj, request, api, shared):
+    has_permission = evaluator_for(obj, request).flags(
+        obj, ['add', 'edit', 'state_change'])
+    has_permission['admin'] = permits('admin', api.root, request)
+    return has_permission
+
+
+@relmeta_section('navitems')
+def _navitems(obj, request, api, shared):
     # for top navbar
+    lineage_ids = set(getattr(node, 'id', None) for node in api.lineage)
     navitems = list()
-    for item in api.list_children(api.navigation_root):
-        if item.in_navigation:
-            idata = dict(inside=api.inside(obj, item),
-                         url=api.url(item),
-                         path=api.path(item),
-                         description=item.description,
-                         title=item.title)
-            navitems.append(idata)
-    relmeta['navitems'] = navitems
-
-
-
-    relmeta['application_url'] = request.application_url
-    relmeta['site_title'] = api.site_title
-    relmeta['root_url'] = api.url(api.root)
-    
+    for item_id, idata in shared.navitems(api.navigation_root):
+        idata = dict(idata)
+        idata['inside'] = item_id in lineage_ids
+        navitems.append(idata)
+    return navitems
+
+
+def _site_info_section(key):
+    """ Registers the ``key`` of ``RelationalMetadataContext.site_info`` as
+    a section. """
+    def section(obj, request, api, shared):
+        return shared.site_info[key]
+    relmeta_section(key)(section)
+
+for _key in ['application_url', 'site_title', 'root_url', 'request_url',
+             'logout_url']:
+    _site_info_section(_key)
+
+
+@relmeta_section('workflow')
+def _workflow(obj, request, api, shared):
     # for edit bar
-    wf = get_workflow(obj, request)
-    if wf['current_state'] is not None:
-        if 'callback' in wf['current_state'].get('data', dict()):
-            del wf['current_state']['data']['callback']
-        for state in wf['states']:
-            sdata = wf['states'][state].get('data', dict())
-            if 'callback' in sdata:
-                del sdata['callback']
-    relmeta['workflow'] = wf
-    relmeta['request_url'] = request.url
-    relmeta['api_url'] = api.url()
-    
+    return describe_workflow(obj, request)
+
+
+@relmeta_section('api_url')
+def _api_url(obj, request, api, shared):
+    return api.url()
+
+
+@relmeta_section('edit_links')
+def _edit_links(obj, request, api, shared):
     edit_links = list()
-    link_parent = None
     for link in api.edit_links:
         if type(link) is not LinkParent:
             link_info = get_link_info(link, obj, request)
@@ -175,94 +519,146 @@ def relational_metadata(obj, request, get_user=True,
             link_info['resource'] = resource
             link_info['command'] = command
             edit_links.append(link_info)
-        else:
+    return edit_links
+
+
+@relmeta_section('link_parent')
+def _link_parent(obj, request, api, shared):
+    link_parent = None
+    for link in api.edit_links:
+        if type(link) is LinkParent:
             link_parent = handle_link_parent(link, obj, request, api)
-    relmeta['edit_links'] =  edit_links
-    relmeta['link_parent'] = link_parent
-    
+    return link_parent
+
+
+@relmeta_section('selectable_default_views')
+def _selectable_default_views(obj, request, api, shared):
     dfs = DefaultViewSelection(obj, request)
     key = 'selectable_default_views'
-    relmeta[key] = dfs.default_view_selector()[key]
-    del dfs
-    del key
-    
-    
-    # add-dropdown
-    factories = get_content_type_factories(obj, request)['factories']
+    return dfs.default_view_selector()[key]
+
+
+@relmeta_section('content_type_factories')
+def _content_type_factories(obj, request, api, shared):
+    # add-dropdown; the addable types only depend on the type of obj and
+    # the permissions on it, so siblings share them
+    key = evaluator_for(obj, request).permissions_key(obj)
+    if key is None:
+        addable = _addable_types(obj, request)
+    else:
+        addable = shared.cached_by(
+            ('content_type_factories', obj.type_info.name) + key,
+            lambda: _addable_types(obj, request))
     flist = list()
-    for f in factories:
-        path = api.path(obj, f.type_info.add_view)
+    for add_view, title in addable:
+        path = api.path(obj, add_view)
         flist.append(dict(
-            url=api.url(obj, f.type_info.add_view),
+            url=api.url(obj, add_view),
             resource=os.path.dirname(path),
             command=os.path.basename(path),
-            title=f.type_info.title,
+            title=title,
             ))
-    relmeta['content_type_factories'] = flist
-    relmeta['upload_url'] = api.url(obj, 'upload')
-
-    # site_setup_linke
-    site_setup_links = list()
-    for link in api.site_setup_links:
-        site_setup_links.append(get_link_info(link, obj, request))
-    # FIXME this fixes a problem where a plugin seems to define an
-    # extra settings link
-    site_setup_urls = list()
-    setup_links = list()
-    for link in site_setup_links:
-        if link['url'] not in site_setup_urls:
-            site_setup_urls.append(link['url'])
-            setup_links.append(link)
-    relmeta['site_setup_links'] = setup_links
-
-    
-    relmeta['navigate_url'] = api.url(obj, '@@navigate')
-    relmeta['logout_url'] = api.url(api.root, '@@logout',
-                                       query=dict(came_from=request.url))
+    return flist
+
+
+def _addable_types(obj, request):
+    factories = get_content_type_factories(obj, request)['factories']
+    return [(f.type_info.add_view, f.type_info.title) for f in factories]
+
+
+@relmeta_section('upload_url')
+def _upload_url(obj, request, api, shared):
+    return api.url(obj, 'upload')
 
+
+@relmeta_section('site_setup_links')
+def _site_setup_links(obj, request, api, shared):
+    return shared.site_setup_links
+
+
+@relmeta_section('navigate_url')
+def _navigate_url(obj, request, api, shared):
+    return api.url(obj, '@@navigate')
+
+
+@relmeta_section('has_location_context')
+def _has_location_context(obj, request, api, shared):
     # page content
-    relmeta['has_location_context'] = api.is_location(obj)
-    relmeta['view_needed'] = api.view_needed
-
-    breadcrumbs = list()
-    for bc in api.breadcrumbs:
-        breadcrumbs.append(dict(id=bc.id,
-                                name=bc.name,
-                                description=bc.description,
-                                url=api.url(bc),
-                                path=api.path(bc),
-                                title=bc.title))
-    relmeta['breadcrumbs'] = breadcrumbs
-
-    lineage = list()
-    for node in api.lineage:
-        lineage.append(dict(id=node.id,
-                            name=node.name,
-                            description=node.description,
-                            url=api.url(node),
-                            path=api.path(node),
-                            title=node.title))
-    relmeta['lineage'] = lineage
+    return api.is_location(obj)
+
+
+@relmeta_section('view_needed')
+def _view_needed(obj, request, api, shared):
+    return api.view_needed
+
+
+@relmeta_section('breadcrumbs')
+def _breadcrumbs(obj, request, api, shared):
+    ancestry = shared.ancestry(obj)
+    navigation_root = api.navigation_root
+    start = 0
+    for index, (node, info) in enumerate(ancestry):
+        if node is navigation_root:
+            start = index
+    return [dict(info) for node, info in ancestry[start:]]
+
+
+@relmeta_section('lineage')
+def _lineage(obj, request, api, shared):
     # FIXME - do this client side
     #http://stackoverflow.com/questions/3705670/best-way-to-create-a-reversed-list-in-python
     #relmeta['lineage_reversed'] = lineage[::-1]
-    
+    return [dict(info) for node, info in reversed(shared.ancestry(obj))]
+
+
+@relmeta_section('paths')
+def _paths(obj, request, api, shared):
     # FIXME figure out what to do about page_slots
     #relmeta['page_slots'] = api.slots
-    relmeta['paths'] = {
-        'this_path': request.resource_path(obj),
-        'child_paths': [request.resource_path(child)
-                        for child in obj.children_with_permission(request)],
-        'childnames': [child.__name__
-                       for child in obj.children_with_permission(request)],
+    children = children_info(obj, request)
+    return {
+        'this_path': shared.location(obj)['path'],
+        'child_paths': children.paths,
+        'childnames': children.names,
     }
-    
-    
 
-    # contents_buttons
-    cbuttons = [get_button_info(b, obj, request)
-                for b in get_contents_buttons(obj, request)]
-    relmeta['contents_buttons'] = cbuttons
 
-    return relmeta
+@relmeta_section('contents_buttons')
+def _contents_buttons(obj, request, api, shared):
+    return [get_button_info(b, obj, request)
+            for b in get_contents_buttons(obj, request)]
 
+
+def relational_metadata(obj, request, get_user=True,
+                        get_type_info=True,
+                        get_permissions=True,
+                        get_extra_info=True,
+                        sections=None):
+    """ Returns the metadata needed by a client to render ``obj`` the way
+    kotti's templates do (navbar, edit bar, breadcrumbs, ...).
+
+    Only the ``sections`` (names in :data:`RELMETA_SECTIONS`) that are
+    asked for are computed. If ``sections`` is ``None`` the ``get_*`` flags
+    decide which sections are returned.
+    """
+    if sections is None:
+        skip = set()
+        if not get_user:
+            skip.add('current_user')
+        if not get_type_info:
+            skip.add('type_info')
+        if not get_permissions:
+            skip.add('has_permission')
+        sections = [name for name in RELMETA_SECTIONS
+                    if name not in skip and
+                    (get_extra_info or name in BASIC_SECTIONS)]
+
+    # some of this is just to mimick templates
+    relmeta = dict()
+    api = JSONTemplateAPI(obj, request)
+    shared = get_relmeta_context(obj, request)
+    # the lineage, and the navigation root, from the shared ancestry
+    api.lineage = [node for node, info in reversed(shared.ancestry(obj))]
+    for name in sections:
+        relmeta[name] = RELMETA_SECTIONS[name](obj, request, api, shared)
+    return relmeta
@@ -17,3 +17,74 @@ def custom_settings():
     return {
         'kotti.configurators': 'kotti_tinymce.kotti_configure '
                                'kotti_jsonapi.kotti_configure'}
+
+
+@fixture
+def jsonapi_config(config):
+    """ A configurator with kotti's views and the ``kotti_jsonapi.rest``
+    views registered.
+    """
+    from kotti.views import RootOnlyPredicate
+    from kotti.views import SettingHasValuePredicate
+
+    config.add_view_predicate('root_only', RootOnlyPredicate)
+    config.add_view_predicate('if_setting_has_value',
+                              SettingHasValuePredicate)
+    for name in ['kotti.views', 'kotti.views.view', 'kotti.views.file',
+                 'kotti.views.login', 'kotti.views.navigation',
+                 'kotti.views.users', 'kotti.views.edit.actions',
+                 'kotti.views.edit.content', 'kotti.views.edit.default_views',
+                 'kotti.views.edit.upload']:
+        config.include(name)
+    config.include('kotti_jsonapi.rest')
+    return config
+
+
+@fixture
+def acl_config(jsonapi_config):
+    """ :func:`jsonapi_config` with pyramid's ACL authorization policy and
+    the ``REMOTE_USER`` as the authenticated user, with Kotti's groups.
+    """
+    from kotti.security import list_groups_callback
+    from pyramid.authentication import RemoteUserAuthenticationPolicy
+    from pyramid.authorization import ACLAuthorizationPolicy
+
+    jsonapi_config.set_authorization_policy(ACLAuthorizationPolicy())
+    jsonapi_config.set_authentication_policy(
+        RemoteUserAuthenticationPolicy(callback=list_groups_callback))
+    return jsonapi_config
+
+
+@fixture
+def count_queries(db_session):
+    """ Returns a function that calls ``func`` and returns the number of SQL
+    statements it executed, and its result.
+    """
+    from sqlalchemy import event
+
+    def count_queries(func):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+        engine = db_session.get_bind()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            result = func()
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        return len(statements), result
+    return count_queries
+
+
+@fixture
+def run_commit_hooks():
+    """ Returns a function that runs the after commit hooks of the current
+    transaction with ``status``, as if it had been committed (or failed to).
+    """
+    import transaction
+
+    def run_commit_hooks(status=True):
+        for hook, args, kws in transaction.get().getAfterCommitHooks():
+            hook(status, *args, **kws)
+    return run_commit_hooks
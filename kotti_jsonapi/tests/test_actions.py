@@ -0,0 +1,94 @@
+from kotti.resources import Document
+from pyramid.httpexceptions import HTTPBadRequest
+from pytest import raises
+
+
+class TestReorderPositions:
+
+    def _reorder(self, order, positions):
+        from kotti_jsonapi.rest import reorder_positions
+        new = reorder_positions(order, positions)
+        assert [new[i] for i in order] == sorted(new.values())
+        assert len(set(new.values())) == len(order)
+        assert min(new.values()) >= 0
+        assert max(new.values()) <= max(
+            list(positions.values()) + [len(order) - 1])
+        return dict((i, p) for i, p in new.items() if positions[i] != p)
+
+    def test_unchanged(self):
+        assert self._reorder([1, 2, 3], {1: 0, 2: 1, 3: 2}) == {}
+
+    def test_to_top(self):
+        positions = dict((i, i + 1) for i in range(300))
+        order = [299] + list(range(299))
+        assert self._reorder(order, positions) == {299: 0}
+
+    def test_to_top_no_gap(self):
+        # never below 0: the nodes it passes are moved down
+        positions = dict((i, i) for i in range(300))
+        order = [299] + list(range(299))
+        new = self._reorder(order, positions)
+        assert new == dict((i, index) for index, i in enumerate(order))
+
+    def test_to_bottom(self):
+        # the nodes before the ones it passes keep their positions
+        assert self._reorder([1, 3, 4, 2], {1: 0, 2: 1, 3: 2, 4: 3}) == {
+            3: 1, 4: 2, 2: 3}
+
+    def test_to_bottom_no_gap(self):
+        # never past the last position
+        assert self._reorder([2, 3, 1], {1: 0, 2: 1, 3: 2}) == {
+            2: 0, 3: 1, 1: 2}
+
+    def test_negative_positions(self):
+        assert self._reorder([3, 1, 2], {1: -2, 2: -1, 3: 0}) == {
+            1: 1, 2: 2}
+
+    def test_into_gap(self):
+        assert self._reorder([1, 3, 2], {1: 0, 2: 5, 3: 10}) == {3: 1}
+
+    def test_no_gap(self):
+        # renumbered, still only the nodes that actually moved
+        assert self._reorder([1, 3, 2, 4], {1: 0, 2: 1, 3: 2, 4: 3}) == {
+            3: 1, 2: 2}
+
+
+class TestReorderView:
+
+    def _tree(self, root, db_session):
+        for index in range(5):
+            root['doc-{0}'.format(index)] = Document()
+        db_session.flush()
+        return [root['doc-{0}'.format(index)].id for index in range(5)]
+
+    def _reorder(self, context, request, **body):
+        from kotti_jsonapi.rest import JSONNodeActions
+        request.json_body = body
+        return JSONNodeActions(context, request).reorder()
+
+    def test_partial(self, jsonapi_config, events, root, db_session,
+                     dummy_request):
+        ids = self._tree(root, db_session)
+        res = self._reorder(root, dummy_request, children=[ids[4]])
+
+        assert [r['name'] for r in res['result']] == [
+            'doc-4', 'doc-0', 'doc-1', 'doc-2', 'doc-3']
+        assert [r['position'] for r in res['result']] == list(range(5))
+        db_session.flush()
+        assert root.keys() == [r['name'] for r in res['result']]
+
+    def test_position(self, jsonapi_config, events, root, db_session,
+                      dummy_request):
+        ids = self._tree(root, db_session)
+        res = self._reorder(root, dummy_request, children=[ids[0], ids[1]],
+                            position=2)
+        assert [r['name'] for r in res['result']] == [
+            'doc-2', 'doc-3', 'doc-0', 'doc-1', 'doc-4']
+
+    def test_unknown_child(self, jsonapi_config, events, root, db_session,
+                           dummy_request):
+        ids = self._tree(root, db_session)
+        with raises(HTTPBadRequest):
+            self._reorder(root, dummy_request, children=[ids[0], root.id])
+        with raises(HTTPBadRequest):
+            self._reorder(root, dummy_request, children=[ids[0], ids[0]])
@@ -0,0 +1,223 @@
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+
+
+def _get(context, request):
+    from kotti_jsonapi.rest import RestView
+    return RestView(context, request).get()
+
+
+class TestDocumentCache:
+
+    def _count_serialize(self, monkeypatch):
+        from kotti_jsonapi import rest
+
+        calls = []
+        serialize = rest.serialize
+
+        def counting(obj, request, **kw):
+            calls.append(obj)
+            return serialize(obj, request, **kw)
+        monkeypatch.setattr(rest, 'serialize', counting)
+        return calls
+
+    def test_cached(self, jsonapi_config, events, workflow, root,
+                    db_session, dummy_request, monkeypatch):
+        calls = self._count_serialize(monkeypatch)
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+
+        first = _get(root['a'], dummy_request)
+        second = _get(root['a'], dummy_request)
+        assert len(calls) == 1
+        assert first == second
+
+        dummy_request.GET['fields[Document]'] = 'title'
+        _get(root['a'], dummy_request)
+        assert len(calls) == 2
+
+    def test_messages_not_cached(self, jsonapi_config, events, workflow, root,
+                                 dummy_request):
+        _get(root, dummy_request)
+        dummy_request.session.flash(u'Saved', 'success')
+        res = _get(root, dummy_request)
+        assert res['meta']['messages']['success'] == [u'Saved']
+        res = _get(root, dummy_request)
+        assert res['meta']['messages']['success'] == []
+
+    def test_events_invalidate_ancestors(self, jsonapi_config, events,
+                                         workflow, root, db_session,
+                                         dummy_request, monkeypatch):
+        calls = self._count_serialize(monkeypatch)
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        _get(root, dummy_request)
+        _get(root['a'], dummy_request)
+
+        root['a'].title = u'Changed'
+        db_session.flush()
+        _get(root, dummy_request)
+        _get(root['a'], dummy_request)
+        assert calls == [root, root['a'], root, root['a']]
+
+    def _request(self, callback, host='example.com'):
+        request = DummyRequest(params=dict(callback=callback))
+        request.host = host + ':80'
+        request.application_url = 'http://' + host
+        request.url = request.application_url + '/?callback=' + callback
+        return request
+
+    def test_host_and_request_url(self, jsonapi_config, events, workflow,
+                                  root, db_session, monkeypatch):
+        calls = self._count_serialize(monkeypatch)
+        one = self._request('one')
+        _get(root, one)
+        relmeta = _get(root, one)['data']['relationships']['meta']
+        assert relmeta['root_url'] == u'http://example.com/'
+        assert len(calls) == 1
+
+        two = self._request('two')
+        relmeta = _get(root, two)['data']['relationships']['meta']
+        assert len(calls) == 1
+        assert relmeta['request_url'] == u'http://example.com/?callback=two'
+        assert 'callback%3Dtwo' in relmeta['logout_url']
+
+        other = self._request('one', host='other.example.com')
+        relmeta = _get(root, other)['data']['relationships']['meta']
+        assert len(calls) == 2
+        assert relmeta['root_url'] == u'http://other.example.com/'
+
+    def test_disabled(self, config):
+        from kotti_jsonapi.cache import get_document_cache
+
+        config.registry.settings['kotti_jsonapi.document_cache_size'] = '0'
+        config.include('kotti_jsonapi.cache')
+        assert get_document_cache(config.registry) is None
+
+
+class TestSiteCache:
+
+    def _navitems(self, obj):
+        from kotti_jsonapi.serializers import relational_metadata
+        return relational_metadata(obj, DummyRequest(),
+                                   sections=['navitems'])['navitems']
+
+    def _count_navitems(self, monkeypatch):
+        from kotti_jsonapi.serializers import RelationalMetadataContext
+
+        calls = []
+        compute = RelationalMetadataContext._compute_navitems
+
+        def counting(self, navigation_root):
+            calls.append(navigation_root)
+            return compute(self, navigation_root)
+        monkeypatch.setattr(RelationalMetadataContext, '_compute_navitems',
+                            counting)
+        return calls
+
+    def test_shared_by_requests(self, jsonapi_config, events, root,
+                                db_session, monkeypatch):
+        calls = self._count_navitems(monkeypatch)
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+
+        assert [i['inside'] for i in self._navitems(root['a'])] == [True]
+        assert [i['inside'] for i in self._navitems(root)] == [False]
+        assert calls == [root]
+
+    def test_varies_by_principals(self, acl_config, events, root,
+                                  db_session, monkeypatch):
+        calls = self._count_navitems(monkeypatch)
+        self._navitems(root)
+
+        from kotti_jsonapi.serializers import relational_metadata
+        request = DummyRequest(environ=dict(REMOTE_USER=u'admin'))
+        relational_metadata(root, request, sections=['navitems'])
+        self._navitems(root)
+        assert len(calls) == 2
+
+    def test_events_clear_after_commit(self, jsonapi_config, events, root,
+                                       db_session, run_commit_hooks):
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        run_commit_hooks()
+        assert len(self._navitems(root)) == 1
+
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        # not committed yet
+        assert len(self._navitems(root)) == 1
+        run_commit_hooks(status=False)
+        assert len(self._navitems(root)) == 1
+        run_commit_hooks()
+        assert len(self._navitems(root)) == 2
+
+        root['b'].in_navigation = False
+        db_session.flush()
+        run_commit_hooks()
+        assert len(self._navitems(root)) == 1
+
+    def test_changing_request_bypasses(self, jsonapi_config, events, root,
+                                       db_session, dummy_request):
+        from kotti_jsonapi.cache import get_site_cache
+
+        cache = get_site_cache(dummy_request.registry)
+        assert cache.get_or_compute(root, dummy_request, 'x', lambda: 1) == 1
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        # the request making the change doesn't see the cached value
+        assert cache.get_or_compute(root, dummy_request, 'x', lambda: 2) == 2
+        assert cache.get_or_compute(root, DummyRequest(), 'x',
+                                    lambda: 3) == 1
+
+    def _factories(self, obj):
+        from kotti_jsonapi.serializers import relational_metadata
+        request = DummyRequest(environ=dict(REMOTE_USER=u'admin'))
+        return relational_metadata(obj, request, sections=[
+            'content_type_factories'])['content_type_factories']
+
+    def test_factories_shared_by_siblings(self, acl_config, events, root,
+                                          db_session, monkeypatch):
+        from kotti.security import set_groups
+        from kotti_jsonapi import serializers
+
+        calls = []
+        addable_types = serializers._addable_types
+
+        def counting(obj, request):
+            calls.append(obj)
+            return addable_types(obj, request)
+        monkeypatch.setattr(serializers, '_addable_types', counting)
+
+        set_groups(u'admin', root, [u'role:admin'])
+        for name in [u'a', u'b', u'c', u'd']:
+            root[name] = Document(title=name)
+        root['c'].__acl__ = [('Deny', 'role:admin', ['add'])]
+        set_groups(u'admin', root['d'], [u'role:editor'])
+        db_session.flush()
+
+        factories = self._factories(root['a'])
+        assert factories
+        assert factories[0]['url'].startswith(u'http://example.com/a/')
+        assert self._factories(root['b']) == [
+            dict(f, url=f['url'].replace(u'/a/', u'/b/'),
+                 resource=f['resource'].replace(u'/a', u'/b'))
+            for f in factories]
+        assert calls == [root['a']]
+
+        # an ACL of its own: computed, and cached, separately
+        self._factories(root['c'])
+        self._factories(root['c'])
+        assert calls == [root['a'], root['c']]
+
+        # local roles of its own: never shared
+        self._factories(root['d'])
+        self._factories(root['d'])
+        assert calls == [root['a'], root['c'], root['d'], root['d']]
+
+    def test_disabled(self, config):
+        from kotti_jsonapi.cache import get_site_cache
+
+        config.registry.settings['kotti_jsonapi.site_cache_size'] = '0'
+        config.include('kotti_jsonapi.cache')
+        assert get_site_cache(config.registry) is None
@@ -0,0 +1,126 @@
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPNotModified
+from pytest import raises
+
+
+def _chrome(context, request):
+    from kotti_jsonapi.chrome import ChromeView
+    return ChromeView(context, request)()
+
+
+class TestChrome:
+
+    def test_site_sections(self, jsonapi_config, events, workflow, root,
+                           db_session, dummy_request):
+        from kotti_jsonapi.serializers import SITE_SECTIONS
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        res = _chrome(root['a'], dummy_request)
+        assert res['data']['type'] == 'chrome'
+        attributes = res['data']['attributes']
+        assert sorted(attributes) == sorted(SITE_SECTIONS)
+        assert attributes['root_url'] == u'http://example.com/'
+        assert [item['title'] for item in attributes['navitems']] == [u'A']
+        assert 'inside' not in attributes['navitems'][0]
+        assert attributes['logout_url'] == u'http://example.com/@@logout'
+
+        response = dummy_request.response
+        assert response.etag
+        assert response.last_modified is None
+        assert response.cache_control.private
+        assert response.cache_control.max_age == 300
+
+    def test_same_for_all_pages(self, jsonapi_config, events, workflow, root,
+                                db_session):
+        from kotti_jsonapi.validators import chrome_etag
+
+        root['a'] = Document(title=u'A')
+        root['a']['b'] = Document(title=u'B')
+        db_session.flush()
+        requests = [DummyRequest(), DummyRequest(), DummyRequest()]
+        requests[1].url = u'http://example.com/a/@@chrome-json'
+        requests[2].url = u'http://example.com/a/b/@@chrome-json'
+        contexts = [root, root['a'], root['a']['b']]
+        assert len(set(chrome_etag(context, request)
+                       for context, request in zip(contexts, requests))) == 1
+        assert len(set(repr(_chrome(context, request))
+                       for context, request in zip(contexts, requests))) == 1
+
+    def test_if_none_match(self, jsonapi_config, events, workflow, root,
+                           db_session, dummy_request):
+        from kotti_jsonapi.validators import chrome_etag
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        etag = chrome_etag(root, dummy_request)
+
+        dummy_request.headers['If-None-Match'] = '"{0}"'.format(etag)
+        res = _chrome(root, dummy_request)
+        assert isinstance(res, HTTPNotModified)
+        assert res.etag == etag
+        assert res.cache_control.max_age == 300
+
+        # a new navigation item changes the chrome
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        assert chrome_etag(root, dummy_request) != etag
+
+        # and so does a removed one
+        etag = chrome_etag(root, dummy_request)
+        del root['a']
+        db_session.flush()
+        assert chrome_etag(root, dummy_request) != etag
+
+    def test_title_changes_etag(self, jsonapi_config, events, workflow, root,
+                                db_session, dummy_request):
+        from kotti_jsonapi.validators import chrome_etag
+
+        etag = chrome_etag(root, dummy_request)
+        root.title = u'Another title'
+        db_session.flush()
+        assert chrome_etag(root, dummy_request) != etag
+
+
+class TestSerializeWithoutChrome:
+
+    def test_serialize(self, jsonapi_config, events, root, db_session):
+        from kotti_jsonapi.rest import serialize
+        from kotti_jsonapi.serializers import SITE_SECTIONS
+
+        relmeta = serialize(root, DummyRequest(params=dict(chrome='false')))[
+            'data']['relationships']['meta']
+        assert 'breadcrumbs' in relmeta
+        assert not set(SITE_SECTIONS) & set(relmeta)
+
+        relmeta = serialize(root, DummyRequest(), chrome=False)[
+            'data']['relationships']['meta']
+        assert not set(SITE_SECTIONS) & set(relmeta)
+
+        relmeta = serialize(root, DummyRequest(params=dict(
+            chrome='false', relmeta='site_title,breadcrumbs')))[
+            'data']['relationships']['meta']
+        assert list(relmeta) == ['breadcrumbs']
+
+        assert set(SITE_SECTIONS) <= set(serialize(root, DummyRequest())[
+            'data']['relationships']['meta'])
+
+    def test_invalid(self, jsonapi_config, root):
+        from kotti_jsonapi.rest import serialize
+
+        with raises(HTTPBadRequest):
+            serialize(root, DummyRequest(params=dict(chrome='maybe')))
+
+    def test_contents(self, jsonapi_config, events, root, db_session):
+        from kotti_jsonapi.rest import NodeContents
+        from kotti_jsonapi.serializers import SITE_SECTIONS
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        request = DummyRequest(params=dict(chrome='false'))
+        res = NodeContents(root, request).get()
+        relmeta = res['data'][0]['data']['relationships']['meta']
+        assert 'breadcrumbs' in relmeta
+        assert not set(SITE_SECTIONS) & set(relmeta)
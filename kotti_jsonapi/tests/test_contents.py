@@ -0,0 +1,220 @@
+from kotti.resources import Document
+from pyramid.httpexceptions import HTTPBadRequest
+from pytest import raises
+
+
+def _add_children(root, db_session, count=5):
+    for index in range(count):
+        root['doc-{0}'.format(index)] = Document(title=u'Doc {0}'.format(index))
+    db_session.flush()
+
+
+def _set_params(request, **params):
+    request.GET = request.params = dict(
+        ('page[{0}]'.format(k), v) for k, v in params.items())
+
+
+class TestContentsPagination:
+
+    def _get(self, context, request):
+        from kotti_jsonapi.rest import NodeContents
+        return NodeContents(context, request).get()
+
+    def test_unpaginated(self, jsonapi_config, events, workflow, root,
+                         db_session, dummy_request):
+        _add_children(root, db_session)
+        res = self._get(root, dummy_request)
+        assert len(res['data']) == 5
+        assert 'links' not in res
+
+    def test_offset(self, jsonapi_config, events, workflow, root,
+                    db_session, dummy_request):
+        _add_children(root, db_session)
+        _set_params(dummy_request, offset=2, limit=2)
+        res = self._get(root, dummy_request)
+
+        assert [c['data']['id'] for c in res['data']] == ['doc-2', 'doc-3']
+        assert [c['meta']['position'] for c in res['data']] == [2, 3]
+        assert res['meta']['total'] == 5
+        assert 'page%5Boffset%5D=4' in res['links']['next']
+        assert 'page%5Boffset%5D=0' in res['links']['prev']
+
+    def test_last_page(self, jsonapi_config, events, workflow, root,
+                       db_session, dummy_request):
+        _add_children(root, db_session)
+        _set_params(dummy_request, offset=4, limit=2)
+        res = self._get(root, dummy_request)
+
+        assert [c['data']['id'] for c in res['data']] == ['doc-4']
+        assert res['links']['next'] is None
+
+    def test_after(self, jsonapi_config, events, workflow, root,
+                   db_session, dummy_request):
+        _add_children(root, db_session)
+        _set_params(dummy_request, after='doc-1', limit=2)
+        res = self._get(root, dummy_request)
+
+        assert [c['data']['id'] for c in res['data']] == ['doc-2', 'doc-3']
+        assert 'page%5Bafter%5D=doc-3' in res['links']['next']
+
+    def test_skips_forbidden_children(self, jsonapi_config, events, workflow,
+                                      root, db_session, dummy_request):
+        from kotti_jsonapi.rest import page_children
+
+        _add_children(root, db_session)
+        forbidden = root['doc-1']
+        dummy_request.has_permission = lambda perm, ctx=None: ctx != forbidden
+        res = page_children(root, dummy_request, offset=0, limit=2)
+
+        assert [c.name for c in res['children']] == ['doc-0', 'doc-2']
+        assert res['scanned'] == 3
+        assert res['has_more']
+        assert res['total'] == 4
+
+    def test_position_not_index(self, jsonapi_config, events, workflow, root,
+                                db_session, dummy_request):
+        _add_children(root, db_session, count=3)
+        forbidden = root['doc-1']
+        dummy_request.has_permission = lambda perm, ctx=None: ctx != forbidden
+
+        res = self._get(root, dummy_request)
+        assert [c['meta']['position'] for c in res['data']] == [0, 2]
+        _set_params(dummy_request, offset=0, limit=5)
+        res = self._get(root, dummy_request)
+        assert [c['meta']['position'] for c in res['data']] == [0, 2]
+        assert res['meta']['total'] == 2
+
+    def test_bad_params(self, dummy_request):
+        from kotti_jsonapi.rest import get_page_params
+
+        _set_params(dummy_request, limit='abc')
+        with raises(HTTPBadRequest):
+            get_page_params(dummy_request)
+
+
+class TestContentsStreaming:
+
+    def _render(self, request, value):
+        import json
+        from kotti_jsonapi.rest import jsonp
+        return json.loads(jsonp(None)(value, dict(request=request)))
+
+    def test_same_as_rendered(self, jsonapi_config, events, workflow, root,
+                              db_session, dummy_request, monkeypatch):
+        import json
+        from kotti_jsonapi import rest
+        from kotti_jsonapi.rest import NodeContents
+
+        monkeypatch.setattr(rest, 'STREAM_BATCH_SIZE', 2)
+        _add_children(root, db_session)
+        expected = self._render(dummy_request,
+                                NodeContents(root, dummy_request).get())
+        response = NodeContents(root, dummy_request).stream()
+        chunks = list(response.app_iter)
+
+        assert len(chunks) > 1
+        assert json.loads(b''.join(chunks).decode('utf-8')) == expected
+
+    def test_iter_children_batches(self, jsonapi_config, events, workflow,
+                                   root, db_session, dummy_request):
+        from kotti_jsonapi.rest import iter_children
+
+        _add_children(root, db_session)
+        forbidden = root['doc-3']
+        dummy_request.has_permission = lambda perm, ctx=None: ctx != forbidden
+        children = iter_children(root, dummy_request, batch_size=2)
+        assert [c.name for c in children] == [
+            'doc-0', 'doc-1', 'doc-2', 'doc-4']
+
+    def test_transaction_ended(self, jsonapi_config, events, workflow, root,
+                               db_session, dummy_request, monkeypatch):
+        import transaction
+        from kotti_jsonapi.rest import NodeContents
+
+        aborted = []
+        monkeypatch.setattr(transaction, 'abort', lambda: aborted.append(1))
+        _add_children(root, db_session, count=2)
+        response = NodeContents(root, dummy_request).stream()
+        # still in the request's transaction
+        list(response.app_iter)
+        assert aborted == []
+
+        response = NodeContents(root, dummy_request).stream()
+        dummy_request._process_finished_callbacks()
+        list(response.app_iter)
+        assert aborted == [1]
+
+    def test_bulk_permissions(self, acl_config, events, workflow, root,
+                              db_session, dummy_request):
+        import json
+        from kotti_jsonapi.rest import NodeContents
+
+        _add_children(root, db_session, count=3)
+        dummy_request.environ['REMOTE_USER'] = u'admin'
+        # the navigation items are checked by kotti
+        dummy_request.GET['chrome'] = 'false'
+        checked = []
+        has_permission = dummy_request.has_permission
+
+        def recording(permission, context=None):
+            checked.append((permission, context))
+            return has_permission(permission, context)
+        dummy_request.has_permission = recording
+
+        response = NodeContents(root, dummy_request).stream()
+        # the context is loaded again while streaming
+        db_session.expunge_all()
+        body = b''.join(response.app_iter).decode('utf-8')
+        assert len(json.loads(body)['data']) == 3
+        assert not [context for permission, context in checked
+                    if permission == 'view' and
+                    getattr(context, 'parent_id', None) == root.id]
+
+    def test_jsonp(self, jsonapi_config, events, workflow, root, db_session,
+                   dummy_request):
+        from kotti_jsonapi.rest import NodeContents
+
+        dummy_request.GET['callback'] = 'handle'
+        response = NodeContents(root, dummy_request).stream()
+        body = b''.join(response.app_iter).decode('utf-8')
+        assert body.startswith(u'/**/handle({"data": [')
+        assert body.endswith(u');')
+        assert response.content_type == 'application/javascript'
+
+
+class TestEagerLoading:
+
+    def _listing_queries(self, folder, db_session, count_queries):
+        from kotti.testing import DummyRequest
+        from kotti_jsonapi.cache import get_site_cache
+        from kotti_jsonapi.rest import NodeContents
+
+        db_session.expire_all()
+        request = DummyRequest()
+        get_site_cache(request.registry).clear()
+        return count_queries(lambda: NodeContents(folder, request).get())[0]
+
+    def test_constant_queries(self, jsonapi_config, events, workflow, root,
+                              db_session, count_queries):
+        root['few'] = Document()
+        root['many'] = Document()
+        _add_children(root['few'], db_session, 2)
+        _add_children(root['many'], db_session, 6)
+        few = self._listing_queries(root['few'], db_session, count_queries)
+        many = self._listing_queries(root['many'], db_session,
+                                     count_queries)
+        assert few == many
+
+    def test_declared_relationships(self, jsonapi_config, events, workflow,
+                                    root, db_session, dummy_request):
+        from kotti_jsonapi.rest import IEagerLoads
+        from kotti_jsonapi.rest import eager_load
+
+        jsonapi_config.registry.registerUtility(
+            ('parent',), IEagerLoads, name='Document')
+        _add_children(root, db_session, 3)
+        db_session.expire_all()
+        children = list(root.children)
+        assert not any('parent' in c.__dict__ for c in children)
+        eager_load(children, dummy_request)
+        assert all('parent' in c.__dict__ for c in children)
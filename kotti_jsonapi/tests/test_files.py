@@ -0,0 +1,94 @@
+from kotti.resources import File
+from webob import Request
+
+
+def _file(root, db_session):
+    root['f'] = File(data=b'0123456789', filename=u'digits.txt',
+                     mimetype='text/plain')
+    db_session.flush()
+    return root['f']
+
+
+class TestFileSerialization:
+
+    def test_metadata(self, jsonapi_config, events, workflow, filedepot,
+                      root, db_session, dummy_request):
+        from kotti_jsonapi.rest import serialize
+
+        f = _file(root, db_session)
+        res = serialize(f, dummy_request)['data']
+
+        assert res['attributes']['filename'] == u'digits.txt'
+        assert res['attributes']['mimetype'] == 'text/plain'
+        assert res['attributes']['size'] == 10
+        assert res['links']['download'] == 'http://example.com/f/download'
+
+    def test_fields(self, jsonapi_config, events, workflow, filedepot,
+                    root, db_session, dummy_request):
+        from kotti_jsonapi.rest import serialize
+
+        f = _file(root, db_session)
+        dummy_request.GET = dummy_request.params = {'fields[File]': 'size'}
+        res = serialize(f, dummy_request)['data']
+        assert sorted(res['attributes'].keys()) == ['oid', 'size']
+
+
+class TestDownload:
+
+    def _get(self, f, dummy_request, **headers):
+        from kotti_jsonapi.rest import download
+        dummy_request.headers.update(headers)
+        return Request.blank('/', headers=headers).get_response(
+            download(f, dummy_request))
+
+    def test_download(self, jsonapi_config, events, workflow, filedepot,
+                      root, db_session, dummy_request):
+        f = _file(root, db_session)
+        response = self._get(f, dummy_request)
+
+        assert response.body == b'0123456789'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert response.content_disposition.startswith('attachment')
+
+    def test_file_wrapper(self, jsonapi_config, events, workflow, filedepot,
+                          root, db_session, dummy_request):
+        from kotti_jsonapi.rest import RangeFileIter
+        from kotti_jsonapi.rest import download
+
+        class FileWrapper(object):
+            def __init__(self, f, block_size):
+                self.f = f
+
+            def __iter__(self):
+                return iter([self.f.read()])
+
+        f = _file(root, db_session)
+        dummy_request.environ['wsgi.file_wrapper'] = FileWrapper
+        response = download(f, dummy_request)
+        assert isinstance(response.app_iter, FileWrapper)
+        assert response.content_length == 10
+
+        dummy_request.headers['Range'] = 'bytes=2-5'
+        response = download(f, dummy_request)
+        assert isinstance(response.app_iter, RangeFileIter)
+        assert response.content_length == 10
+
+    def test_range(self, jsonapi_config, events, workflow, filedepot,
+                   root, db_session, dummy_request):
+        f = _file(root, db_session)
+        response = self._get(f, dummy_request, Range='bytes=2-5')
+
+        assert response.status_int == 206
+        assert response.body == b'2345'
+        assert response.headers['Content-Range'] == 'bytes 2-5/10'
+
+    def test_range_iter_without_seek(self):
+        from io import BytesIO
+        from kotti_jsonapi.rest import RangeFileIter
+
+        class Unseekable(BytesIO):
+            def seekable(self):
+                return False
+
+        it = RangeFileIter(Unseekable(b'0123456789'), block_size=3)
+        assert b''.join(it.app_iter_range(4, 9)) == b'45678'
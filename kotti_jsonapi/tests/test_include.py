@@ -0,0 +1,71 @@
+from kotti.resources import Document
+from pyramid.httpexceptions import HTTPBadRequest
+from pytest import raises
+
+
+def _get(context, request, include):
+    from kotti_jsonapi.rest import RestView
+    request.GET = request.params = dict(include=include)
+    return RestView(context, request).get()
+
+
+def _tree(root, db_session):
+    root['a'] = Document(title=u'A')
+    root['a']['x'] = Document(title=u'X')
+    root['a']['y'] = Document(title=u'Y')
+    root['a']['x']['z'] = Document(title=u'Z')
+    db_session.flush()
+    return root['a']
+
+
+class TestInclude:
+
+    def test_children(self, jsonapi_config, events, root, db_session,
+                      dummy_request):
+        a = _tree(root, db_session)
+        res = _get(a, dummy_request, 'children')
+
+        assert [r['id'] for r in res['included']] == ['x', 'y']
+        assert res['included'][0]['meta']['path'] == u'/a/x/'
+        assert 'relationships' not in res['included'][0]
+        assert res['data']['id'] == 'a'
+        relationships = res['data']['relationships']
+        assert relationships['children']['data'] == [
+            dict(type='Document', id='x'), dict(type='Document', id='y')]
+        assert 'meta' in relationships
+        assert 'parent' not in relationships
+
+    def test_parent_and_grandchildren(self, jsonapi_config, events, root,
+                                      db_session, dummy_request):
+        a = _tree(root, db_session)
+        res = _get(a, dummy_request, 'parent,children.children')
+        assert [r['meta']['path'] for r in res['included']] == [
+            u'/', u'/a/x/', u'/a/y/', u'/a/x/z/']
+        relationships = res['data']['relationships']
+        assert relationships['parent']['data'] == dict(type='Document',
+                                                       id=u'')
+        x, y = res['included'][1:3]
+        assert x['relationships']['children']['data'] == [
+            dict(type='Document', id='z')]
+        assert y['relationships']['children']['data'] == []
+
+    def test_root_parent(self, jsonapi_config, events, root, dummy_request):
+        res = _get(root, dummy_request, 'parent')
+        assert res['included'] == []
+        assert res['data']['relationships']['parent'] == dict(data=None)
+
+    def test_batched(self, jsonapi_config, events, root, db_session,
+                     dummy_request, count_queries):
+        from kotti_jsonapi.rest import get_included
+
+        a = _tree(root, db_session)
+        db_session.expire_all()
+        a = root['a']
+        queries, _ = count_queries(
+            lambda: get_included(a, dummy_request, set(['children.children'])))
+        # children, grandchildren and great-grandchildren
+        assert queries == 3
+
+    def test_unknown(self, jsonapi_config, root, dummy_request):
+        with raises(HTTPBadRequest):
+            _get(root, dummy_request, 'owner')
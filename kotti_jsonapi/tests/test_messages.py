@@ -0,0 +1,59 @@
+from kotti.testing import DummyRequest
+
+
+class LazySessionRequest(DummyRequest):
+    """ Like pyramid's requests, the session is only loaded when used.
+    """
+    loaded = False
+
+    @property
+    def session(self):
+        self.loaded = True
+        return self._session
+
+    @session.setter
+    def session(self, value):
+        self._session = value
+
+
+class TestGetMessages:
+
+    def test_no_session_cookie(self, jsonapi_config):
+        from kotti_jsonapi.messages import get_messages
+        from kotti_jsonapi.messages import has_flash_messages
+
+        request = LazySessionRequest()
+        assert get_messages(request) == dict(
+            info=[], success=[], error=[], warning=[], default=[])
+        assert has_flash_messages(request) is False
+        assert request.loaded is False
+
+    def test_session_cookie(self, jsonapi_config, monkeypatch):
+        from kotti_jsonapi.messages import get_messages
+
+        request = LazySessionRequest(cookies={'beaker.session.id': 'abc'})
+        session = request._session
+        session.flash(u'Saved', 'success')
+        session.flash(u'Hello')
+        popped = []
+        pop_flash = session.pop_flash
+        monkeypatch.setattr(session, 'pop_flash', lambda queue='': (
+            popped.append(queue) or pop_flash(queue)))
+
+        messages = get_messages(request)
+        assert request.loaded is True
+        assert messages['success'] == [u'Saved']
+        assert messages['default'] == [u'Hello']
+        assert messages['info'] == []
+        # only the queues with messages are popped
+        assert sorted(popped) == ['', 'success']
+        assert get_messages(request)['success'] == []
+
+    def test_session_used(self, jsonapi_config, dummy_request):
+        from kotti_jsonapi.messages import get_messages
+        from kotti_jsonapi.messages import has_flash_messages
+
+        dummy_request.session.flash(u'Saved', 'success')
+        assert has_flash_messages(dummy_request)
+        assert get_messages(dummy_request)['success'] == [u'Saved']
+        assert not has_flash_messages(dummy_request)
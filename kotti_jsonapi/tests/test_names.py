@@ -0,0 +1,65 @@
+from kotti.resources import Document
+
+
+class TestUniqueName:
+
+    def test_free(self, root, db_session):
+        from kotti_jsonapi.rest import unique_name
+        assert unique_name(root, u'Hello World') == u'hello-world'
+
+    def test_disambiguate(self, root, db_session):
+        from kotti_jsonapi.rest import unique_name
+
+        for name in [u'doc', u'doc-1', u'doc-2', u'doc_x', u'docs']:
+            root[name] = Document()
+        db_session.flush()
+        assert unique_name(root, u'Doc') == u'doc-3'
+        assert unique_name(root, u'Doc 1') == u'doc-1-1'
+
+    def test_no_children_loaded(self, root, db_session):
+        from kotti_jsonapi.rest import ChildNames
+
+        root['doc'] = Document()
+        db_session.flush()
+        db_session.expire(root)
+        names = ChildNames(root)
+        assert u'doc' in names
+        assert u'doc-1' not in names
+        assert u'other' not in names
+        assert '_children' not in root.__dict__
+
+    def test_new_parent(self, root, db_session):
+        from kotti_jsonapi.rest import ChildNames
+
+        parent = Document()
+        parent['doc'] = Document()
+        assert u'doc' in ChildNames(parent)
+
+    def test_highest_suffix(self, root, db_session):
+        from kotti_jsonapi.rest import unique_name
+
+        for name in [u'doc', u'doc-2', u'doc-10', u'doc-9', u'doc-011',
+                     u'doc-10-1', u'doc-x', u'doc-99x']:
+            root[name] = Document()
+        db_session.flush()
+        assert unique_name(root, u'Doc') == u'doc-11'
+
+        parent = Document()
+        for name in [u'doc', u'doc-2', u'doc-10', u'doc-x']:
+            parent[name] = Document()
+        assert unique_name(parent, u'Doc') == u'doc-11'
+
+    def test_constant_queries(self, root, db_session, count_queries):
+        from kotti_jsonapi.rest import unique_name
+
+        for i in range(50):
+            root[unique_name(root, u'Doc')] = Document()
+        db_session.flush()
+        assert u'doc-49' in root.keys()
+        db_session.expire(root)
+        root.id
+
+        count, name = count_queries(lambda: unique_name(root, u'Doc'))
+        assert name == u'doc-50'
+        assert count == 2
+        assert '_children' not in root.__dict__
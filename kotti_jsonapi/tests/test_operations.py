@@ -0,0 +1,77 @@
+from kotti.resources import Document
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPUnprocessableEntity
+from pytest import raises
+
+
+def _post(context, request, *operations):
+    from kotti_jsonapi.operations import OperationsView
+    request.json_body = {'atomic:operations': list(operations)}
+    return OperationsView(context, request)()
+
+
+def _add(title, lid=None, parent_lid=None):
+    data = dict(type='Document', attributes=dict(title=title))
+    if lid is not None:
+        data['lid'] = lid
+    if parent_lid is not None:
+        data['relationships'] = dict(parent=dict(data=dict(lid=parent_lid)))
+    return dict(op='add', data=data)
+
+
+class TestOperations:
+
+    def test_add_with_lid(self, jsonapi_config, events, root, db_session,
+                          dummy_request):
+        res = _post(root, dummy_request,
+                    _add(u'Folder', lid='f'),
+                    _add(u'Page', parent_lid='f'))
+        results = res['atomic:results']
+
+        assert [r['data']['id'] for r in results] == ['folder', 'page']
+        assert root['folder']['page'].title == u'Page'
+
+    def test_update_and_remove(self, jsonapi_config, events, root,
+                               db_session, dummy_request):
+        root['a'] = Document(title=u'A')
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+
+        res = _post(root, dummy_request,
+                    dict(op='update', ref=dict(type='Document', id='a'),
+                         data=dict(type='Document',
+                                   attributes=dict(title=u'New'))),
+                    dict(op='remove', href='/b/'))
+
+        assert res['atomic:results'][0]['data']['attributes']['title'] == \
+            u'New'
+        assert res['atomic:results'][1] == {}
+        assert root['a'].title == u'New'
+        assert 'b' not in root.keys()
+
+    def test_all_or_nothing(self, jsonapi_config, events, root, db_session,
+                            dummy_request):
+        import transaction
+
+        with raises(HTTPNotFound) as e:
+            _post(root, dummy_request,
+                  _add(u'Kept?'),
+                  dict(op='remove', ref=dict(type='Document', id='nope')))
+
+        assert e.value.json_body['errors'][0]['source']['pointer'] == \
+            '/atomic:operations/1'
+        assert transaction.get().isDoomed()
+
+    def test_validation(self, jsonapi_config, events, root, db_session,
+                        dummy_request):
+        with raises(HTTPUnprocessableEntity) as e:
+            _post(root, dummy_request,
+                  dict(op='add', data=dict(type='Document', attributes={})))
+        assert 'title' in e.value.json_body['errors'][0]['detail']
+
+    def test_permissions(self, jsonapi_config, events, root, db_session,
+                         dummy_request):
+        dummy_request.has_permission = lambda perm, ctx=None: False
+        with raises(HTTPForbidden):
+            _post(root, dummy_request, _add(u'Page'))
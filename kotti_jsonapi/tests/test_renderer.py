@@ -0,0 +1,67 @@
+import datetime
+import json
+
+import colander
+from pytest import importorskip
+from pytest import raises
+
+
+def _render(request, value):
+    from kotti_jsonapi.rest import jsonp
+    return jsonp(None)(value, dict(request=request))
+
+
+class TestJSONBackend:
+
+    def test_default(self):
+        from kotti_jsonapi.rest import json_serializer
+        assert json_serializer() is json.dumps
+        assert json_serializer('json') is json.dumps
+
+    def test_unknown(self):
+        from pyramid.exceptions import ConfigurationError
+        from kotti_jsonapi.rest import json_serializer
+        with raises(ConfigurationError):
+            json_serializer('yaml')
+
+    def test_fallback(self, monkeypatch):
+        from kotti_jsonapi import rest
+
+        def missing():
+            raise ImportError
+        monkeypatch.setitem(rest.JSON_BACKENDS, 'orjson', missing)
+        monkeypatch.setitem(rest.JSON_BACKENDS, 'simplejson', missing)
+        assert rest.json_serializer('orjson') is json.dumps
+        assert rest.json_serializer('auto') is json.dumps
+
+    def test_setting(self, config, monkeypatch):
+        from kotti_jsonapi import rest
+
+        def dumps(value, default=None, **kw):
+            return json.dumps(value, default=default, sort_keys=True)
+        monkeypatch.setitem(rest.JSON_BACKENDS, 'simplejson', lambda: dumps)
+        monkeypatch.setattr(rest.jsonp, 'serializer', rest.jsonp.serializer)
+        monkeypatch.setattr(config, 'scan', lambda *args, **kw: None)
+        config.registry.settings['kotti_jsonapi.json_backend'] = 'simplejson'
+        rest.includeme(config)
+        assert rest.jsonp.serializer is dumps
+
+    def test_adapters_and_callback(self, dummy_request):
+        value = dict(date=datetime.date(2016, 1, 2), null=colander.null)
+        assert json.loads(_render(dummy_request, value)) == \
+            dict(date=u'2016-01-02', null=None)
+
+        dummy_request.GET['callback'] = 'handle'
+        body = _render(dummy_request, value)
+        assert body.startswith('/**/handle(') and body.endswith(');')
+
+    def test_orjson(self, dummy_request, monkeypatch):
+        importorskip('orjson')
+        from kotti_jsonapi import rest
+
+        monkeypatch.setattr(rest.jsonp, 'serializer',
+                            rest.json_serializer('orjson'))
+        value = dict(when=datetime.datetime(2016, 1, 2, 3, 4, 5),
+                     date=datetime.date(2016, 1, 2), null=colander.null)
+        assert json.loads(_render(dummy_request, value)) == \
+            dict(when=u'2016-01-02T03:04:05', date=u'2016-01-02', null=None)
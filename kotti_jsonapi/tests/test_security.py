@@ -0,0 +1,97 @@
+from kotti.resources import Document
+from pytest import fixture
+from pytest import mark
+
+
+@fixture
+def tree(acl_config, events, workflow, root, db_session):
+    from kotti.security import get_principals
+    from kotti.security import set_groups
+    from kotti.workflow import get_workflow
+
+    get_principals()[u'bob'] = dict(name=u'bob', title=u'Bob')
+    root['folder'] = folder = Document(title=u'Folder')
+    for name in ['private', 'public', 'shared']:
+        folder[name] = Document(title=name)
+    db_session.flush()
+    get_workflow(folder).transition_to_state(folder, None, u'public')
+    get_workflow(folder['public']).transition_to_state(
+        folder['public'], None, u'public')
+    set_groups(u'bob', folder['shared'], [u'role:editor'])
+    db_session.flush()
+    return folder
+
+
+class TestPermissionEvaluator:
+
+    @mark.parametrize('user', [None, u'bob', u'admin'])
+    def test_same_as_has_permission(self, tree, dummy_request, user):
+        from kotti.security import authz_context
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        if user is not None:
+            dummy_request.environ['REMOTE_USER'] = user
+        evaluator = PermissionEvaluator(tree, dummy_request)
+        assert evaluator.enabled
+
+        for context in [tree] + list(tree.children):
+            for permission in ['view', 'edit', 'add', 'state_change']:
+                # like kotti.request.Request.has_permission
+                with authz_context(context, dummy_request):
+                    expected = bool(
+                        dummy_request.has_permission(permission, context))
+                assert evaluator.permits(permission, context) == expected
+
+    def test_filter(self, tree, dummy_request):
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        evaluator = PermissionEvaluator(tree, dummy_request)
+        assert [c.name for c in evaluator.filter(tree.children)] == [
+            u'public']
+
+        dummy_request.environ['REMOTE_USER'] = u'bob'
+        evaluator = PermissionEvaluator(tree, dummy_request)
+        assert [c.name for c in evaluator.filter(tree.children, 'edit')] == [
+            u'shared']
+
+    @mark.parametrize('user', [None, u'bob', u'admin'])
+    def test_count_children(self, tree, db_session, dummy_request, user):
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        tree['plain'] = Document(title=u'Plain')
+        db_session.flush()
+        tree['plain']._acl = None
+        db_session.flush()
+        if user is not None:
+            dummy_request.environ['REMOTE_USER'] = user
+        evaluator = PermissionEvaluator(tree, dummy_request)
+        for permission in ['view', 'edit']:
+            assert evaluator.count_children(permission) == len(
+                evaluator.filter(tree.children, permission))
+
+    def test_permissions_key(self, tree, db_session, dummy_request):
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        tree['private2'] = Document(title=u'Private 2')
+        db_session.flush()
+        evaluator = PermissionEvaluator(tree, dummy_request)
+        key = evaluator.permissions_key
+        assert key(tree['private']) == key(tree['private2'])
+        assert key(tree['private']) != key(tree['public'])
+        assert key(tree['shared']) is None
+        assert key(tree) is not None
+        assert key(tree.__parent__) is None
+
+        dummy_request.environ['REMOTE_USER'] = u'bob'
+        assert PermissionEvaluator(tree, dummy_request).permissions_key(
+            tree['private']) != key(tree['private'])
+
+    def test_fallback_without_acl_policy(self, jsonapi_config, root,
+                                         dummy_request):
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        jsonapi_config.testing_securitypolicy(permissive=False)
+        evaluator = PermissionEvaluator(root, dummy_request)
+
+        assert not evaluator.enabled
+        assert not evaluator.permits('view', root)
@@ -0,0 +1,208 @@
+from kotti.resources import Document
+
+
+class TestRelationalMetadata:
+
+    def _make_children(self, root, db_session):
+        root['a'] = Document(title=u'A')
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        return root['a'], root['b']
+
+    def test_site_sections_are_shared(self, jsonapi_config, events, workflow,
+                                      root, db_session, dummy_request):
+        from kotti_jsonapi.serializers import relational_metadata
+
+        a, b = self._make_children(root, db_session)
+        ra = relational_metadata(a, dummy_request)
+        rb = relational_metadata(b, dummy_request)
+
+        assert ra['current_user'] is rb['current_user']
+        assert ra['site_setup_links'] is rb['site_setup_links']
+        assert ra['site_title'] == rb['site_title']
+
+    def test_navitems_inside(self, jsonapi_config, events, workflow,
+                             root, db_session, dummy_request):
+        from kotti_jsonapi.serializers import relational_metadata
+
+        a, b = self._make_children(root, db_session)
+        ra = relational_metadata(a, dummy_request)
+        rb = relational_metadata(b, dummy_request)
+
+        assert [i['inside'] for i in ra['navitems']] == [True, False]
+        assert [i['inside'] for i in rb['navitems']] == [False, True]
+
+
+class TestSparseFieldsets:
+
+    def _serialize(self, obj, request, **params):
+        from kotti_jsonapi.rest import serialize
+        request.GET = request.params = params
+        return serialize(obj, request)
+
+    def test_fields(self, jsonapi_config, events, workflow, root, db_session,
+                    dummy_request):
+        root['a'] = Document(title=u'A', body=u'Body')
+        db_session.flush()
+        res = self._serialize(root['a'], dummy_request,
+                              **{'fields[Document]': 'title'})
+
+        assert sorted(res['data']['attributes'].keys()) == ['oid', 'title']
+        assert 'children' not in res['data']['links']
+
+    def test_fields_other_type(self, jsonapi_config, events, workflow, root,
+                               db_session, dummy_request):
+        root['a'] = Document(title=u'A', body=u'Body')
+        db_session.flush()
+        res = self._serialize(root['a'], dummy_request,
+                              **{'fields[File]': 'title'})
+
+        assert res['data']['attributes']['body'] == u'Body'
+        assert 'children' in res['data']['links']
+
+    def test_meta_and_relmeta(self, jsonapi_config, events, workflow, root,
+                              db_session, dummy_request):
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        res = self._serialize(root['a'], dummy_request, meta='path,state',
+                              relmeta='breadcrumbs,has_permission')
+
+        assert sorted(res['meta'].keys()) == ['messages', 'path', 'state']
+        assert sorted(res['data']['relationships']['meta'].keys()) == [
+            'breadcrumbs', 'has_permission']
+
+    def test_unknown_relmeta_section(self, jsonapi_config, root, db_session,
+                                     dummy_request):
+        from pyramid.httpexceptions import HTTPBadRequest
+        from pytest import raises
+
+        with raises(HTTPBadRequest):
+            self._serialize(root, dummy_request, relmeta='foo')
+
+
+class TestAncestry:
+
+    def _deep(self, root, db_session):
+        root['a'] = Document(title=u'A', description=u'Desc')
+        root['a']['b c'] = Document(title=u'B')
+        root['a']['b c']['d'] = Document(title=u'D')
+        db_session.flush()
+        return root['a']['b c']['d']
+
+    def test_same_as_traversal(self, jsonapi_config, events, root,
+                               db_session, dummy_request):
+        from pyramid.location import lineage
+        from kotti_jsonapi.serializers import relational_metadata
+
+        d = self._deep(root, db_session)
+        relmeta = relational_metadata(
+            d, dummy_request, sections=['breadcrumbs', 'lineage', 'paths'])
+
+        nodes = list(lineage(d))
+        assert relmeta['lineage'] == [
+            dict(id=node.id, name=node.name, description=node.description,
+                 title=node.title, url=dummy_request.resource_url(node),
+                 path=dummy_request.resource_path(node)) for node in nodes]
+        assert relmeta['breadcrumbs'] == relmeta['lineage'][::-1]
+        assert relmeta['lineage'][1]['url'] == \
+            u'http://example.com/a/b%20c/'
+        assert relmeta['paths']['this_path'] == u'/a/b%20c/d/'
+
+    def test_navigation_root(self, jsonapi_config, events, root,
+                             db_session, dummy_request):
+        from kotti.interfaces import INavigationRoot
+        from zope.interface import alsoProvides
+        from kotti_jsonapi.serializers import relational_metadata
+
+        d = self._deep(root, db_session)
+        alsoProvides(root['a'], INavigationRoot)
+        relmeta = relational_metadata(d, dummy_request,
+                                      sections=['breadcrumbs'])
+        assert [b['name'] for b in relmeta['breadcrumbs']] == [
+            u'a', u'b c', u'd']
+
+    def test_one_query(self, jsonapi_config, events, root, db_session,
+                       dummy_request, count_queries):
+        from kotti.resources import Node
+        from kotti_jsonapi.serializers import RelationalMetadataContext
+
+        d_id = self._deep(root, db_session).id
+        db_session.expunge_all()
+        d = db_session.query(Node).get(d_id)
+        shared = RelationalMetadataContext(d, dummy_request)
+
+        def ancestries():
+            ancestry = shared.ancestry(d)
+            shared.ancestry(d.__parent__)
+            return ancestry
+        queries, ancestry = count_queries(ancestries)
+        assert queries == 1
+        assert [info['path'] for node, info in ancestry] == [
+            u'/', u'/a/', u'/a/b%20c/', u'/a/b%20c/d/']
+
+
+class TestChildrenInfo:
+
+    def test_children_looked_up_once(self, jsonapi_config, events, workflow,
+                                     root, db_session, dummy_request,
+                                     monkeypatch):
+        from kotti_jsonapi.rest import serialize
+        from kotti_jsonapi.security import PermissionEvaluator
+
+        root['a'] = Document(title=u'A')
+        root['a']['b'] = Document(title=u'B')
+        db_session.flush()
+
+        calls = []
+        orig = PermissionEvaluator.filter
+
+        def filter(self, children, permission='view'):
+            calls.append(self.parent.id)
+            return orig(self, children, permission)
+        monkeypatch.setattr(PermissionEvaluator, 'filter', filter)
+
+        res = serialize(root['a'], dummy_request)
+
+        assert calls == [root['a'].id]
+        assert res['data']['links']['children'] == ['http://example.com/a/b/']
+        paths = res['data']['relationships']['meta']['paths']
+        assert paths['child_paths'] == ['/a/b/']
+        assert paths['childnames'] == ['b']
+
+
+class TestCompiledSerializer:
+
+    def test_same_as_schema(self, jsonapi_config, events, workflow, root,
+                            db_session, dummy_request):
+        from kotti_jsonapi.rest import MetadataSchema
+        from kotti_jsonapi.rest import get_metadata_serializer
+        from kotti_jsonapi.rest import get_schema
+        from kotti_jsonapi.rest import get_serializer
+
+        root['a'] = Document(title=u'A', body=u'Body', tags=[u'x'])
+        db_session.flush()
+        for obj in (root, root['a']):
+            schema = get_schema(obj, dummy_request)
+            compiled = get_serializer(obj, dummy_request)
+            assert compiled(obj.__dict__) == schema.serialize(obj.__dict__)
+            meta = get_metadata_serializer(dummy_request)
+            assert meta(obj.__dict__) == \
+                MetadataSchema().serialize(obj.__dict__)
+
+    def test_fields(self, jsonapi_config, root, dummy_request):
+        from kotti_jsonapi.rest import get_serializer
+
+        res = get_serializer(root, dummy_request)(root.__dict__,
+                                                  set(['title', 'foo']))
+        assert res == {'title': root.title}
+
+    def test_cached_in_registry(self, jsonapi_config, root, dummy_request):
+        from kotti_jsonapi.rest import SERIALIZERS_KEY
+        from kotti_jsonapi.rest import get_serializer
+
+        serializer = get_serializer(root, dummy_request)
+        assert get_serializer(root, dummy_request) is serializer
+
+        jsonapi_config.scan('kotti_jsonapi.rest')
+        assert SERIALIZERS_KEY not in jsonapi_config.registry
+        assert get_serializer(root, dummy_request) is not serializer
@@ -0,0 +1,86 @@
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+from pyramid.httpexceptions import HTTPBadRequest
+from pytest import raises
+
+
+def _site(root, db_session):
+    root['a'] = Document(title=u'A')
+    root['b'] = Document(title=u'B')
+    root['a']['x'] = Document(title=u'X')
+    root['a']['y'] = Document(title=u'Y')
+    root['a']['x']['z'] = Document(title=u'Z')
+    root['a_b'] = Document(title=u'Not below a')
+    db_session.flush()
+
+
+def _get(context, **params):
+    from kotti_jsonapi.tree import TreeView
+    return TreeView(context, DummyRequest(params=params))()
+
+
+def _ids(resource):
+    return [(child['id'], _ids(child)) for child in
+            resource.get('relationships', {}).get('children', {}).get(
+                'data', [])]
+
+
+class TestTree:
+
+    def test_depth(self, jsonapi_config, root, db_session):
+        _site(root, db_session)
+
+        result = _get(root)
+        assert _ids(result['data']) == [
+            ('a', [('x', []), ('y', [])]), ('b', []), ('a_b', [])]
+        assert result['meta']['count'] == 5
+        assert result['meta']['truncated'] is False
+
+        result = _get(root['a'], depth='1')
+        assert _ids(result['data']) == [('x', []), ('y', [])]
+        a = result['data']
+        assert a['links']['self'] == u'http://example.com/a/'
+        assert a['relationships']['children']['data'][0]['links'] == dict(
+            self=u'http://example.com/a/x/')
+        assert a['relationships']['children']['data'][1]['attributes'][
+            'title'] == u'Y'
+
+        result = _get(root['a'], depth='5')
+        assert _ids(result['data']) == [('x', [('z', [])]), ('y', [])]
+
+    def test_one_query(self, jsonapi_config, root, db_session,
+                       count_queries):
+        from kotti_jsonapi.tree import load_subtree
+
+        _site(root, db_session)
+        db_session.expire_all()
+        root.path  # load the context itself
+        queries, (nodes, truncated) = count_queries(
+            lambda: load_subtree(root, 3, 100))
+        assert queries == 1
+        assert [node.name for node in nodes] == [
+            u'a', u'b', u'a_b', u'x', u'y', u'z']
+
+    def test_max_nodes(self, jsonapi_config, root, db_session):
+        _site(root, db_session)
+        result = _get(root, depth='3', max_nodes='4')
+        assert _ids(result['data']) == [
+            ('a', [('x', []), ]), ('b', []), ('a_b', [])]
+        assert result['meta']['truncated'] is True
+
+        jsonapi_config.registry.settings['kotti_jsonapi.tree_max_nodes'] = 2
+        result = _get(root, max_nodes='100')
+        assert result['meta']['count'] == 2
+
+    def test_permissions(self, acl_config, root, db_session):
+        _site(root, db_session)
+        root['a']['x'].__acl__ = [['Deny', 'system.Everyone', ['view']]]
+        db_session.flush()
+        result = _get(root['a'], depth='3')
+        assert _ids(result['data']) == [('y', [])]
+
+    def test_bad_params(self, jsonapi_config, root):
+        with raises(HTTPBadRequest):
+            _get(root, depth='0')
+        with raises(HTTPBadRequest):
+            _get(root, max_nodes='many')
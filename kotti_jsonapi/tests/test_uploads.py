@@ -0,0 +1,120 @@
+from io import BytesIO
+
+from pyramid.httpexceptions import HTTPConflict
+from pyramid.httpexceptions import HTTPLengthRequired
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPRequestEntityTooLarge
+from pytest import fixture
+from pytest import raises
+
+
+@fixture
+def upload_config(jsonapi_config, tmpdir):
+    jsonapi_config.registry.settings['kotti_jsonapi.upload_dir'] = \
+        str(tmpdir)
+    return jsonapi_config
+
+
+def _views(context, request, subpath=(), body=None, **headers):
+    from kotti_jsonapi.uploads import UploadViews
+    request.subpath = tuple(subpath)
+    request.headers.update(headers)
+    if body is not None:
+        request.body_file = BytesIO(body)
+        request.content_length = len(body)
+    return UploadViews(context, request)
+
+
+def _initiate(root, request, **attributes):
+    attributes.setdefault('filename', u'digits.txt')
+    attributes.setdefault('mimetype', 'text/plain')
+    request.json_body = dict(data=dict(type='File', attributes=attributes))
+    return _views(root, request).post()['data']['id']
+
+
+class TestUploads:
+
+    def test_chunks(self, upload_config, events, workflow, filedepot, root,
+                    db_session, dummy_request, run_commit_hooks):
+        upload_id = _initiate(root, dummy_request, title=u'Digits', size=10)
+
+        res = _views(root, dummy_request, [upload_id], b'01234',
+                     **{'Content-Range': 'bytes 0-4/10'}).put()
+        assert res['data']['attributes']['received'] == 5
+        res = _views(root, dummy_request, [upload_id], b'56789',
+                     **{'Content-Range': 'bytes 5-9/10'}).put()
+        assert res['data']['attributes']['received'] == 10
+
+        response = _views(root, dummy_request, [upload_id]).post()
+        assert response.status_int == 201
+        f = root['digits']
+        assert f.data.file.read() == b'0123456789'
+        assert (f.filename, f.mimetype, f.size) == (
+            u'digits.txt', 'text/plain', 10)
+        # removed once committed
+        run_commit_hooks(status=False)
+        assert _views(root, dummy_request, [upload_id]).get()
+        run_commit_hooks()
+        with raises(HTTPNotFound):
+            _views(root, dummy_request, [upload_id]).get()
+
+    def test_without_length(self, upload_config, root, dummy_request):
+        upload_id = _initiate(root, dummy_request)
+        views = _views(root, dummy_request, [upload_id], b'0123456789')
+        dummy_request.content_length = None
+        dummy_request.is_body_readable = False
+        with raises(HTTPLengthRequired):
+            views.put()
+
+        dummy_request.is_body_readable = True
+        res = views.put()
+        assert res['data']['attributes']['received'] == 10
+
+    def test_too_large(self, upload_config, root, dummy_request,
+                       monkeypatch):
+        from kotti import get_settings
+
+        monkeypatch.setitem(get_settings(), 'kotti.max_file_size', '1')
+        upload_id = _initiate(root, dummy_request)
+        _views(root, dummy_request, [upload_id], b'0123').put()
+        views = _views(root, dummy_request, [upload_id],
+                       b'x' * (1024 * 1024))
+        dummy_request.content_length = None
+        dummy_request.is_body_readable = True
+        with raises(HTTPRequestEntityTooLarge):
+            views.put()
+        assert _views(root, dummy_request, [upload_id]).get()[
+            'data']['attributes']['received'] == 4
+
+    def test_resume(self, upload_config, root, dummy_request):
+        upload_id = _initiate(root, dummy_request)
+        _views(root, dummy_request, [upload_id], b'0123').put()
+        # the last chunk got lost halfway, it's resent from the offset
+        res = _views(root, dummy_request, [upload_id], b'23456',
+                     **{'Content-Range': 'bytes 2-6/10'}).put()
+        assert res['data']['attributes']['received'] == 7
+        assert _views(root, dummy_request, [upload_id]).get()[
+            'data']['attributes']['received'] == 7
+
+    def test_gap(self, upload_config, root, dummy_request):
+        upload_id = _initiate(root, dummy_request)
+        with raises(HTTPConflict):
+            _views(root, dummy_request, [upload_id], b'89',
+                   **{'Content-Range': 'bytes 8-9/10'}).put()
+
+    def test_size_mismatch(self, upload_config, root, dummy_request):
+        upload_id = _initiate(root, dummy_request, size=10)
+        _views(root, dummy_request, [upload_id], b'0123').put()
+        with raises(HTTPConflict):
+            _views(root, dummy_request, [upload_id]).post()
+
+    def test_unknown_upload(self, upload_config, root, dummy_request):
+        with raises(HTTPNotFound):
+            _views(root, dummy_request, ['../etc']).get()
+        with raises(HTTPNotFound):
+            _views(root, dummy_request, ['abc']).get()
+
+    def test_cancel(self, upload_config, root, dummy_request, tmpdir):
+        upload_id = _initiate(root, dummy_request)
+        _views(root, dummy_request, [upload_id]).delete()
+        assert tmpdir.listdir() == []
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+from pyramid.traversal import ResourceURL
+
+
+def _site(root, db_session):
+    root['a'] = Document(title=u'A')
+    root['a'][u'b c'] = Document(title=u'B')
+    root['a'][u'b c'][u'd\xe9'] = Document(title=u'D')
+    db_session.flush()
+    return [root, root['a'], root['a'][u'b c'], root['a'][u'b c'][u'd\xe9']]
+
+
+class TestIncrementalResourceURL:
+
+    def test_same_as_pyramid(self, root, db_session):
+        from kotti_jsonapi.urls import IncrementalResourceURL
+
+        nodes = _site(root, db_session)
+        for environ in [{}, {'HTTP_X_VHM_ROOT': '/a'}]:
+            request = DummyRequest(environ=environ)
+            for node in nodes:
+                expected = ResourceURL(node, request)
+                result = IncrementalResourceURL(node, request)
+                for attr in ['virtual_path', 'physical_path',
+                             'virtual_path_tuple', 'physical_path_tuple']:
+                    assert getattr(result, attr) == getattr(expected, attr)
+
+    def test_registered(self, jsonapi_config, root, db_session):
+        nodes = _site(root, db_session)
+        request = DummyRequest()
+        assert request.resource_url(nodes[3], 'edit', query=dict(x=1)) == \
+            'http://example.com/a/b%20c/d%C3%A9/edit?x=1'
+        assert request.resource_path(nodes[2]) == '/a/b%20c/'
+        assert getattr(request, '_kotti_jsonapi_paths')
+
+    def test_memoized(self, root, db_session, monkeypatch):
+        from kotti_jsonapi import urls
+
+        nodes = _site(root, db_session)
+        request = DummyRequest()
+        quoted = []
+        quote = urls.quote_path_segment
+
+        def counting(segment):
+            quoted.append(segment)
+            return quote(segment)
+        monkeypatch.setattr(urls, 'quote_path_segment', counting)
+
+        urls.IncrementalResourceURL(nodes[3], request)
+        urls.IncrementalResourceURL(nodes[2], request)
+        root['a'][u'b c'][u'x'] = Document()
+        urls.IncrementalResourceURL(root['a'][u'b c'][u'x'], request)
+        assert quoted == [u'a', u'b c', u'd\xe9', u'x']
+
+    def test_renamed_or_moved(self, jsonapi_config, root, db_session,
+                              dummy_request):
+        nodes = _site(root, db_session)
+        assert dummy_request.resource_path(nodes[3]) == '/a/b%20c/d%C3%A9/'
+        nodes[1].name = u'z'
+        assert dummy_request.resource_path(nodes[3]) == '/z/b%20c/d%C3%A9/'
+        nodes[2].parent = root
+        assert dummy_request.resource_path(nodes[3]) == '/b%20c/d%C3%A9/'
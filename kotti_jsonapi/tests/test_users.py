@@ -0,0 +1,105 @@
+from kotti.testing import DummyRequest
+
+
+def _add_principals(db_session):
+    from kotti.security import get_principals
+
+    principals = get_principals()
+    principals[u'group:staff'] = dict(name=u'group:staff', title=u'Staff',
+                                      groups=[u'role:editor'])
+    principals[u'group:office'] = dict(name=u'group:office', title=u'Office',
+                                       groups=[u'group:staff'])
+    for index in range(12):
+        name = u'user{0:02d}'.format(index)
+        principals[name] = dict(name=name, title=u'User {0}'.format(index),
+                                email=u'{0}@example.com'.format(name),
+                                groups=[u'group:office'] if index % 2 else [])
+    db_session.flush()
+
+
+class TestListPrincipalsGroups:
+
+    def test_same_as_list_groups_ext(self, root, db_session):
+        from kotti.security import get_principals
+        from kotti.security import list_groups_ext
+        from kotti_jsonapi.rest import list_principals_groups
+
+        _add_principals(db_session)
+        principals = list(get_principals().search(name=u'*'))
+        result = list_principals_groups(principals)
+        for principal in principals:
+            groups, inherited = list_groups_ext(principal.name)
+            assert sorted(result[principal.name][0]) == sorted(groups)
+            assert sorted(result[principal.name][1]) == sorted(inherited)
+        assert sorted(result[u'user01'][0]) == [
+            u'group:office', u'group:staff', u'role:editor']
+
+
+class TestAvatarUrl:
+
+    def test_same_as_template_api(self, root, db_session):
+        from kotti.security import get_principals
+        from kotti.views.util import TemplateAPI
+        from kotti_jsonapi.rest import avatar_url
+
+        _add_principals(db_session)
+        api = TemplateAPI(root, DummyRequest())
+        for name in [u'user01', u'admin', u'group:staff']:
+            principal = get_principals()[name]
+            assert avatar_url(principal) == api.avatar_url(principal)
+            assert avatar_url(principal) == api.avatar_url(principal)
+
+
+class TestSetupUsersSearch:
+
+    def _call(self, root, **params):
+        from kotti_jsonapi.rest import JSONUsersManage
+
+        return JSONUsersManage(root, DummyRequest(params=params))()
+
+    def test_page(self, root, db_session):
+        _add_principals(db_session)
+        result = self._call(root, query=u'user', **{'page[limit]': '5'})
+
+        entries = result['data']['entries']
+        assert [e['principal']['name'] for e in entries] == [
+            u'user00', u'user01', u'user02', u'user03', u'user04']
+        assert result['meta']['total'] == 12
+        assert 'page%5Boffset%5D=5' in result['links']['next']
+        assert result['links']['prev'] is None
+        assert sorted(entries[1]['enabled']) == [
+            u'group:office', u'group:staff', u'role:editor']
+        assert sorted(entries[1]['disabled']) == [
+            u'group:staff', u'role:editor']
+        assert entries[0]['principal']['avatar_url'].startswith(
+            u'https://secure.gravatar.com/avatar/')
+        assert [r['name'] for r in result['data']['available_roles']] == [
+            u'role:viewer', u'role:editor', u'role:owner', u'role:admin']
+
+    def test_after(self, root, db_session):
+        _add_principals(db_session)
+        result = self._call(root, **{'page[after]': u'user09',
+                                     'page[limit]': '5'})
+        assert [e['principal']['name'] for e in result['data']['entries']] \
+            == [u'user10', u'user11']
+        assert result['links']['next'] is None
+
+    def test_after_has_more(self, root, db_session):
+        _add_principals(db_session)
+        result = self._call(root, **{'page[after]': u'user00',
+                                     'page[limit]': '2'})
+        assert [e['principal']['name'] for e in result['data']['entries']] \
+            == [u'user01', u'user02']
+        assert 'page%5Bafter%5D=user02' in result['links']['next']
+
+    def test_filter(self, root, db_session):
+        _add_principals(db_session)
+        result = self._call(root, **{'filter[query]': u'OFFICE'})
+        assert [e['principal']['name'] for e in result['data']['entries']] \
+            == [u'group:office']
+        assert result['meta']['total'] == 1
+
+    def test_no_search(self, root, db_session):
+        result = self._call(root)
+        assert result['data']['entries'] == []
+        assert 'user_addform' in result['data']
@@ -0,0 +1,142 @@
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+from pyramid.httpexceptions import HTTPNotModified
+
+
+def _get(context, request):
+    from kotti_jsonapi.rest import RestView
+    return RestView(context, request).get()
+
+
+class TestConditionalGet:
+
+    def test_validators_set(self, jsonapi_config, events, workflow, root,
+                            db_session, dummy_request):
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        assert _get(root['a'], dummy_request)['data']['id'] == u'a'
+        assert dummy_request.response.etag
+        assert dummy_request.response.last_modified is None
+
+    def test_if_none_match(self, jsonapi_config, events, workflow, root,
+                           db_session, dummy_request):
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        _get(root['a'], dummy_request)
+        etag = dummy_request.response.etag
+
+        dummy_request.headers['If-None-Match'] = '"{0}"'.format(etag)
+        res = _get(root['a'], dummy_request)
+        assert isinstance(res, HTTPNotModified)
+        assert res.etag == etag
+
+    def test_changes_invalidate(self, jsonapi_config, events, workflow, root,
+                                db_session, dummy_request):
+        from kotti_jsonapi.validators import content_etag
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        etag = content_etag(root, dummy_request)
+
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        etag_added = content_etag(root, dummy_request)
+        assert etag_added != etag
+
+        dummy_request.GET['fields[Document]'] = 'title'
+        assert content_etag(root, dummy_request) != etag_added
+
+    def test_principals(self, jsonapi_config, events, workflow, root,
+                        db_session, dummy_request, monkeypatch):
+        from kotti_jsonapi.security import PermissionEvaluator
+        from kotti_jsonapi.validators import content_etag
+
+        monkeypatch.setattr(PermissionEvaluator, 'principals',
+                            ['system.Everyone'])
+        etag = content_etag(root, dummy_request)
+        monkeypatch.setattr(PermissionEvaluator, 'principals',
+                            ['system.Everyone', 'bob'])
+        assert content_etag(root, dummy_request) != etag
+
+    def test_grandchildren(self, jsonapi_config, events, workflow, root,
+                           db_session, dummy_request):
+        from kotti_jsonapi.rest import NodeContents
+        from kotti_jsonapi.validators import content_etag
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        NodeContents(root, dummy_request).get()
+        contents_etag = dummy_request.response.etag
+        etag = content_etag(root, dummy_request)
+        dummy_request.GET['include'] = 'children'
+        include_etag = content_etag(root, dummy_request)
+        del dummy_request.GET['include']
+
+        # the children of a child are linked from @@contents-json
+        root['a']['x'] = Document(title=u'X')
+        db_session.flush()
+        request = DummyRequest()
+        request.headers['If-None-Match'] = '"{0}"'.format(contents_etag)
+        res = NodeContents(root, request).get()
+        assert not isinstance(res, HTTPNotModified)
+        assert request.response.etag != contents_etag
+        # but not from @@json, unless the children are included
+        assert content_etag(root, dummy_request) == etag
+        dummy_request.GET['include'] = 'children'
+        assert content_etag(root, dummy_request) != include_etag
+
+        # the included grandchildren link to their children
+        dummy_request.GET['include'] = 'children.children'
+        deep_etag = content_etag(root, dummy_request)
+        root['a']['x']['y'] = Document(title=u'Y')
+        db_session.flush()
+        assert content_etag(root, dummy_request) != deep_etag
+
+    def test_reorder_and_remove(self, jsonapi_config, events, workflow,
+                                root, db_session, dummy_request):
+        from kotti_jsonapi.rest import NodeContents
+
+        root['a'] = Document(title=u'A')
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        NodeContents(root, dummy_request).get()
+        etag = dummy_request.response.etag
+        dummy_request.headers['If-None-Match'] = '"{0}"'.format(etag)
+        assert isinstance(NodeContents(root, dummy_request).get(),
+                          HTTPNotModified)
+
+        root.children.insert(0, root.children.pop(1))
+        db_session.flush()
+        res = NodeContents(root, dummy_request).get()
+        assert not isinstance(res, HTTPNotModified)
+        reordered = dummy_request.response.etag
+        assert reordered != etag
+
+        del root['a']
+        db_session.flush()
+        NodeContents(root, dummy_request).get()
+        assert dummy_request.response.etag not in (etag, reordered)
+
+    def test_if_modified_since_ignored(self, jsonapi_config, events,
+                                       workflow, root, db_session,
+                                       dummy_request):
+        from kotti_jsonapi.rest import NodeContents
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        NodeContents(root, dummy_request).get()
+        assert 'Last-Modified' not in dummy_request.response.headers
+
+        dummy_request.headers['If-Modified-Since'] = \
+            'Fri, 01 Jan 2100 00:00:00 GMT'
+        res = NodeContents(root, dummy_request).get()
+        assert not isinstance(res, HTTPNotModified)
+
+    def test_flash_messages(self, jsonapi_config, events, workflow, root,
+                            db_session, dummy_request):
+        _get(root, dummy_request)
+        dummy_request.headers['If-None-Match'] = '"{0}"'.format(
+            dummy_request.response.etag)
+        dummy_request.session.flash(u'Saved', 'success')
+        res = _get(root, dummy_request)
+        assert res['meta']['messages']['success'] == [u'Saved']
@@ -0,0 +1,81 @@
+from kotti.resources import Document
+from kotti.testing import DummyRequest
+
+
+def _scrub(value):
+    # kotti's data without the callbacks, with plain titles
+    if isinstance(value, dict):
+        return dict((k, _scrub(v)) for k, v in value.items()
+                    if k != 'callback')
+    if isinstance(value, list):
+        return [_scrub(v) for v in value]
+    if isinstance(value, basestring):
+        return u'' + value
+    return value
+
+
+class TestWorkflowTable:
+
+    def test_same_as_workflow_view(self, jsonapi_config, events, workflow,
+                                   root, db_session, dummy_request):
+        from kotti.views.edit.actions import workflow as workflow_view
+        from kotti_jsonapi.workflows import describe_workflow
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        expected = _scrub(workflow_view(root['a'], dummy_request))
+        result = describe_workflow(root['a'], dummy_request)
+        assert result == expected
+        assert result['current_state']['name'] == u'private'
+        assert [t['name'] for t in result['transitions']] == [
+            u'private_to_public']
+
+    def test_callbacks_kept(self, jsonapi_config, events, workflow, root,
+                            db_session, dummy_request):
+        from kotti.workflow import get_workflow
+        from kotti_jsonapi.serializers import relational_metadata
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        relmeta = relational_metadata(root['a'], dummy_request,
+                                      sections=['workflow'])
+        assert 'callback' not in relmeta['workflow']['current_state']['data']
+        state_data = get_workflow(root['a'])._state_data
+        assert state_data[u'private']['callback'] is not None
+
+        # initializes the workflow of the new document
+        root['b'] = Document(title=u'B')
+        db_session.flush()
+        assert root['b'].state == u'private'
+
+    def test_transitions_permitted(self, acl_config, events, workflow,
+                                   root, db_session):
+        from kotti.security import get_principals
+        from kotti.security import set_groups
+        from kotti_jsonapi.workflows import describe_workflow
+
+        get_principals()[u'bob'] = dict(name=u'bob', title=u'Bob')
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        set_groups(u'bob', root['a'], [u'role:editor'])
+        db_session.flush()
+
+        result = describe_workflow(root['a'], DummyRequest())
+        assert result['transitions'] == []
+        assert result['states'][u'public']['transitions'] == []
+
+        request = DummyRequest(environ=dict(REMOTE_USER=u'bob'))
+        result = describe_workflow(root['a'], request)
+        assert [t['name'] for t in result['transitions']] == [
+            u'private_to_public']
+        assert result['states'][u'public']['transitions'] == \
+            result['transitions']
+
+    def test_compiled_once(self, jsonapi_config, events, workflow, root,
+                           db_session, dummy_request):
+        from kotti_jsonapi.workflows import get_workflow_table
+
+        root['a'] = Document(title=u'A')
+        db_session.flush()
+        table = get_workflow_table(root, dummy_request)
+        assert get_workflow_table(root['a'], dummy_request) is table
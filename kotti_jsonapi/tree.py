@@ -0,0 +1,132 @@
+""" Subtrees of content
+
+``GET <context>/@@tree-json?depth=<n>`` returns the descendants of the
+context down to ``depth`` levels (``1`` are the children) as nested
+resources, each with its children in ``relationships.children.data``::
+
+    {"data": {"type": "Document", "id": "", "attributes": {...},
+              "links": {"self": "http://example.com/"},
+              "relationships": {"children": {"data": [
+                  {"type": "Document", "id": "about", ...}]}}},
+     "meta": {"depth": 2, "count": 12, "truncated": false}}
+
+The whole subtree is loaded with a single query on Kotti's materialized
+``path`` column, shallowest levels first, and only a few attributes of each
+node are serialized. Permissions are checked in bulk for the children of
+each node, and the descendants of nodes that can't be viewed are left out.
+
+At most ``max_nodes`` nodes are returned (the smaller of the parameter and
+the ``kotti_jsonapi.tree_max_nodes`` setting, ``1000`` by default). When the
+subtree is larger, its deepest nodes are cut off and ``meta.truncated`` is
+set.
+"""
+
+from kotti import DBSession
+from kotti.resources import Node
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.view import view_config
+from sqlalchemy import func
+
+from kotti_jsonapi.rest import ACCEPT
+from kotti_jsonapi.rest import BaseRestView
+from kotti_jsonapi.rest import get_messages
+from kotti_jsonapi.security import get_permission_evaluator
+
+DEFAULT_DEPTH = 2
+MAX_DEPTH = 10
+DEFAULT_MAX_NODES = 1000
+TREE_ATTRIBUTES = ('title', 'description', 'state', 'in_navigation')
+
+
+def _level():
+    # the number of slashes in the path: 1 for the root, 2 for its children
+    return func.length(Node.path) - func.length(
+        func.replace(Node.path, u'/', u''))
+
+
+def load_subtree(context, depth, max_nodes):
+    """ Returns the descendants of ``context`` down to ``depth`` levels,
+    ordered by level and position, and whether there were more than
+    ``max_nodes``.
+    """
+    level = context.path.count(u'/')
+    nodes = DBSession.query(Node).filter(
+        Node.path.startswith(context.path, autoescape=True),
+        _level() > level, _level() <= level + depth).order_by(
+        _level(), Node.parent_id, Node.position, Node.id).limit(
+        max_nodes + 1).all()
+    return nodes[:max_nodes], len(nodes) > max_nodes
+
+
+def tree_resource(node, url):
+    """ The lightweight resource object of ``node`` in a tree.
+    """
+    attributes = dict(name=node.name, position=node.position)
+    for key in TREE_ATTRIBUTES:
+        if hasattr(node, key):
+            attributes[key] = getattr(node, key)
+    return dict(type=node.type_info.name, id=node.__name__,
+                attributes=attributes, links=dict(self=url))
+
+
+def build_tree(context, request, depth, max_nodes):
+    """ Returns the resource object of ``context`` with its permitted
+    descendants nested in it, and the number of descendants.
+    """
+    nodes, truncated = load_subtree(context, depth, max_nodes)
+    children = dict()
+    for node in nodes:
+        children.setdefault(node.parent_id, []).append(node)
+
+    top = tree_resource(context, request.resource_url(context))
+    count = 0
+    level = [(context, top)]
+    for _ in range(depth):
+        next_level = list()
+        for parent, resource in level:
+            permitted = get_permission_evaluator(parent, request).filter(
+                children.get(parent.id, ()))
+            data = list()
+            for child in permitted:
+                child_resource = tree_resource(
+                    child, request.resource_url(child))
+                data.append(child_resource)
+                next_level.append((child, child_resource))
+            resource['relationships'] = dict(children=dict(data=data))
+            count += len(data)
+        level = next_level
+    return top, count, truncated
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        value = int(request.params.get(name, default))
+    except ValueError:
+        raise HTTPBadRequest()
+    if value < 1:
+        raise HTTPBadRequest()
+    return min(value, maximum)
+
+
+@view_config(name='tree-json', accept=ACCEPT, renderer='kotti_jsonp',
+             request_method='GET', permission='view', http_cache=0)
+class TreeView(BaseRestView):
+    """ The ``@@tree-json`` view, see the module's documentation.
+    """
+
+    def __call__(self):
+        settings = self.request.registry.settings
+        limit = int(settings.get('kotti_jsonapi.tree_max_nodes',
+                                 DEFAULT_MAX_NODES))
+        depth = _int_param(self.request, 'depth', DEFAULT_DEPTH, MAX_DEPTH)
+        max_nodes = _int_param(self.request, 'max_nodes', limit, limit)
+
+        data, count, truncated = build_tree(self.context, self.request,
+                                            depth, max_nodes)
+        meta = dict(messages=get_messages(self.request), depth=depth,
+                    count=count, truncated=truncated)
+        return dict(data=data, meta=meta)
+
+
+def includeme(config):
+    config.scan(__name__)
@@ -0,0 +1,301 @@
+""" Chunked, resumable uploads of files and images
+
+Creating a :class:`~kotti.resources.File` with a ``PUT`` to ``@@json``
+needs the whole file in the JSON body. The ``@@upload-json`` views upload
+it in chunks instead, which are spooled to a temporary file:
+
+``POST <container>/@@upload-json``
+    Starts an upload. The body is a JSONAPI document with the ``type``
+    (``File`` or ``Image``) and the ``title``, ``description``, ``filename``,
+    ``mimetype`` and ``size`` attributes. Responds with the upload's ``id``
+    and its URL.
+
+``PUT <container>/@@upload-json/<id>``
+    Writes the request body at the offset given by a ``Content-Range:
+    bytes <first>-<last>/<size>`` header (or the ``offset`` parameter,
+    appending by default). Chunks may be sent again from any offset up
+    to the number of bytes received so far. Bodies without a
+    ``Content-Length`` are read to their end if the server supports it
+    (``wsgi.input_terminated``), and refused with ``411`` otherwise.
+
+``GET <container>/@@upload-json/<id>``
+    Returns the number of bytes received, to resume an upload.
+
+``POST <container>/@@upload-json/<id>``
+    Creates the content from the spooled file. The upload is removed once
+    the content is committed.
+
+``DELETE <container>/@@upload-json/<id>``
+    Cancels the upload.
+
+The spool directory is set with ``kotti_jsonapi.upload_dir`` (a
+``kotti_jsonapi_uploads`` directory in the system's temporary directory by
+default). Uploads older than ``kotti_jsonapi.upload_max_age`` seconds
+(default one day) are removed.
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import transaction
+from kotti import get_settings
+from kotti.util import _to_fieldstorage
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPConflict
+from pyramid.httpexceptions import HTTPCreated
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.httpexceptions import HTTPLengthRequired
+from pyramid.httpexceptions import HTTPNoContent
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPRequestEntityTooLarge
+from pyramid.renderers import render
+from pyramid.view import view_config
+from pyramid.view import view_defaults
+from webob.byterange import ContentRange
+
+from kotti_jsonapi.rest import ACCEPT
+from kotti_jsonapi.rest import BaseRestView
+from kotti_jsonapi.rest import get_content_factory
+from kotti_jsonapi.rest import unique_name
+
+UPLOAD_TYPES = ('File', 'Image')
+UPLOAD_ATTRIBUTES = ('title', 'description', 'filename', 'mimetype', 'size')
+DEFAULT_MAX_AGE = 24 * 60 * 60
+BLOCK_SIZE = 64 * 1024
+
+
+class Upload(object):
+    """ An upload in progress: a ``<id>.part`` file with the bytes received
+    so far and a ``<id>.json`` file with its metadata.
+    """
+
+    def __init__(self, directory, upload_id):
+        self.id = upload_id
+        self.path = os.path.join(directory, upload_id + '.part')
+        self.info_path = os.path.join(directory, upload_id + '.json')
+
+    @classmethod
+    def create(cls, directory, info):
+        upload = cls(directory, uuid.uuid4().hex)
+        with open(upload.info_path, 'w') as f:
+            json.dump(info, f)
+        open(upload.path, 'wb').close()
+        return upload
+
+    @classmethod
+    def get(cls, directory, upload_id):
+        """ Returns the upload with ``upload_id``, ``None`` if there's no
+        such upload.
+        """
+        if not upload_id.isalnum():
+            return None
+        upload = cls(directory, upload_id)
+        if not os.path.exists(upload.info_path):
+            return None
+        return upload
+
+    @property
+    def info(self):
+        with open(self.info_path) as f:
+            return json.load(f)
+
+    @property
+    def received(self):
+        return os.path.getsize(self.path)
+
+    def write(self, offset, stream, length=None, limit=None):
+        """ Writes ``length`` bytes read from ``stream`` (up to its end if
+        ``length`` is ``None``) at ``offset``, dropping what was written
+        after it before.
+
+        Returns ``False``, writing nothing, if there are more than ``limit``
+        bytes.
+        """
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            f.truncate()
+            written = 0
+            while length is None or written < length:
+                size = BLOCK_SIZE
+                if length is not None:
+                    size = min(size, length - written)
+                data = stream.read(size)
+                if not data:
+                    break
+                written += len(data)
+                if limit is not None and written > limit:
+                    f.seek(offset)
+                    f.truncate()
+                    return False
+                f.write(data)
+        return True
+
+    def remove(self):
+        for path in (self.path, self.info_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def upload_dir(settings):
+    directory = settings.get('kotti_jsonapi.upload_dir') or os.path.join(
+        tempfile.gettempdir(), 'kotti_jsonapi_uploads')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def remove_expired_uploads(directory, max_age):
+    """ Removes the files of uploads not touched for ``max_age`` seconds.
+    """
+    limit = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:  # removed concurrently
+            pass
+
+
+def _chunk_offset(request, received):
+    header = request.headers.get('Content-Range')
+    if header is not None:
+        content_range = ContentRange.parse(header)
+        if content_range is None or content_range.start is None:
+            raise HTTPBadRequest()
+        return content_range.start
+    try:
+        return int(request.params.get('offset', received))
+    except ValueError:
+        raise HTTPBadRequest()
+
+
+def _remove_after_commit(status, upload):
+    if status:
+        upload.remove()
+
+
+@view_defaults(name='upload-json', accept=ACCEPT, renderer='kotti_jsonp',
+               http_cache=0)
+class UploadViews(BaseRestView):
+    """ The ``@@upload-json`` views, see the module's documentation.
+    """
+
+    @property
+    def directory(self):
+        return upload_dir(self.request.registry.settings)
+
+    def _check_add_permission(self, type_name):
+        klass = get_content_factory(self.request, type_name)
+        add_permission = klass.type_info.add_permission
+        if not self.request.has_permission(add_permission, self.context):
+            raise HTTPForbidden()
+        return klass
+
+    def _upload(self):
+        if len(self.request.subpath) != 1:
+            raise HTTPNotFound()
+        upload = Upload.get(self.directory, self.request.subpath[0])
+        if upload is None:
+            raise HTTPNotFound()
+        info = upload.info
+        if info['parent_id'] != self.context.id or \
+                info['userid'] != self.request.authenticated_userid:
+            raise HTTPNotFound()
+        return upload, info
+
+    def _status(self, upload, info):
+        url = self.request.resource_url(self.context, 'upload-json',
+                                        upload.id)
+        return dict(data=dict(type='upload', id=upload.id,
+                              attributes=dict(info['attributes'],
+                                              received=upload.received),
+                              links=dict(self=url)))
+
+    @view_config(request_method='POST', permission='view')
+    def post(self):
+        if self.request.subpath:
+            return self.finalize()
+        data = self.request.json_body['data']
+        if data.get('type') not in UPLOAD_TYPES:
+            raise HTTPBadRequest()
+        self._check_add_permission(data['type'])
+        attributes = dict((key, value)
+                          for key, value in data.get('attributes', {}).items()
+                          if key in UPLOAD_ATTRIBUTES)
+        if not attributes.get('filename'):
+            raise HTTPBadRequest()
+
+        settings = self.request.registry.settings
+        remove_expired_uploads(self.directory, int(settings.get(
+            'kotti_jsonapi.upload_max_age', DEFAULT_MAX_AGE)))
+        info = dict(type=data['type'], attributes=attributes,
+                    parent_id=self.context.id,
+                    userid=self.request.authenticated_userid)
+        upload = Upload.create(self.directory, info)
+
+        self.request.response.status_int = 201
+        return self._status(upload, info)
+
+    @view_config(request_method='GET', permission='view')
+    def get(self):
+        return self._status(*self._upload())
+
+    @view_config(request_method='PUT', permission='view')
+    def put(self):
+        upload, info = self._upload()
+        received = upload.received
+        offset = _chunk_offset(self.request, received)
+        if offset < 0 or offset > received:
+            raise HTTPConflict()
+        # without a length, a (chunked) body is read up to its end
+        length = self.request.content_length
+        if length is None and not self.request.is_body_readable:
+            raise HTTPLengthRequired()
+        max_size = int(get_settings()['kotti.max_file_size']) * 1024 * 1024
+        if offset + (length or 0) > max_size or not upload.write(
+                offset, self.request.body_file, length, max_size - offset):
+            raise HTTPRequestEntityTooLarge()
+        return self._status(upload, info)
+
+    def finalize(self):
+        upload, info = self._upload()
+        klass = self._check_add_permission(info['type'])
+        attributes = info['attributes']
+        size = upload.received
+        if attributes.get('size') not in (None, size):
+            raise HTTPConflict()
+
+        with open(upload.path, 'rb') as f:
+            fs = _to_fieldstorage(fp=f, filename=attributes['filename'],
+                                  mimetype=attributes.get('mimetype') or
+                                  'application/octet-stream',
+                                  size=size)
+            try:
+                new_item = klass.from_field_storage(fs)
+            except ValueError:
+                raise HTTPBadRequest()
+        new_item.title = attributes.get('title') or attributes['filename']
+        new_item.description = attributes.get('description') or u''
+        name = unique_name(self.context, new_item.title)
+        self.context[name] = new_item
+        # kept until the content is committed, so that it can be retried
+        transaction.get().addAfterCommitHook(_remove_after_commit,
+                                             args=(upload,))
+
+        response = HTTPCreated()
+        response.body = render('kotti_jsonp', new_item, self.request)
+        return response
+
+    @view_config(request_method='DELETE', permission='view')
+    def delete(self):
+        upload, info = self._upload()
+        upload.remove()
+        return HTTPNoContent()
+
+
+def includeme(config):
+    config.scan(__name__)
@@ -0,0 +1,103 @@
+""" Incremental resource URLs
+
+Pyramid's :class:`~pyramid.traversal.ResourceURL` builds the path of a
+resource by walking its whole lineage and quoting every name, for each
+``request.resource_url`` and ``request.resource_path`` call. Serializing a
+listing calls them for every child, its ancestors and its navigation
+items, which repeats the same work many times.
+
+:class:`IncrementalResourceURL` is registered as the resource URL adapter
+of Kotti's nodes. It derives the path of a node from the path of its
+parent, remembered for the rest of the request, and its quoted name. The
+URLs are the same as pyramid's, virtual roots included. Renaming or moving
+a node forgets the paths remembered by the current request.
+"""
+
+from kotti.interfaces import INode
+from kotti.resources import Node
+from pyramid.threadlocal import get_current_request
+from pyramid.traversal import ResourceURL
+from pyramid.traversal import quote_path_segment
+from sqlalchemy import event
+
+PATHS_ATTR = '_kotti_jsonapi_paths'
+
+
+def physical_path(resource, request):
+    """ Returns the physical path tuple of ``resource`` and its joined,
+    quoted path (``''`` for the root), memoized on ``request``.
+
+    A memoized path is only used while the resource has the same parent
+    and name, see also :func:`forget_paths`.
+    """
+    paths = getattr(request, PATHS_ATTR, None)
+    if paths is None:
+        paths = dict()
+        setattr(request, PATHS_ATTR, paths)
+
+    parent = resource.__parent__
+    name = resource.__name__ or ''
+    entry = paths.get(id(resource))
+    if entry is not None and entry[0] is resource and \
+            entry[1] is parent and entry[2] == name:
+        return entry[3], entry[4]
+
+    if parent is None:
+        path_tuple = (name,)
+        joined = quote_path_segment(name) if name else ''
+    else:
+        parent_tuple, parent_joined = physical_path(parent, request)
+        path_tuple = parent_tuple + (name,)
+        joined = parent_joined + '/' + quote_path_segment(name)
+    # the resource is kept, so that its id isn't reused by another object
+    paths[id(resource)] = (resource, parent, name, path_tuple, joined)
+    return path_tuple, joined
+
+
+class IncrementalResourceURL(ResourceURL):
+    """ A :class:`~pyramid.traversal.ResourceURL` that builds the physical
+    path with :func:`physical_path`.
+    """
+
+    def __init__(self, resource, request):
+        physical_path_tuple, physical_path_ = physical_path(resource, request)
+        physical_path_ = physical_path_ or '/'
+
+        # from here on, as in pyramid's ResourceURL
+        if physical_path_tuple != ('',):
+            physical_path_tuple = physical_path_tuple + ('',)
+            physical_path_ = physical_path_ + '/'
+
+        virtual_path = physical_path_
+        virtual_path_tuple = physical_path_tuple
+
+        vroot_path = request.environ.get(self.VH_ROOT_KEY)
+        if vroot_path is not None:
+            vroot_path = vroot_path.rstrip('/')
+            if vroot_path and physical_path_.startswith(vroot_path):
+                vroot_path_tuple = tuple(vroot_path.split('/'))
+                numels = len(vroot_path_tuple)
+                virtual_path_tuple = ('',) + physical_path_tuple[numels:]
+                virtual_path = physical_path_[len(vroot_path):]
+
+        self.virtual_path = virtual_path
+        self.physical_path = physical_path_
+        self.virtual_path_tuple = virtual_path_tuple
+        self.physical_path_tuple = physical_path_tuple
+
+
+def forget_paths(target, value, oldvalue, initiator):
+    """ Drops the paths memoized by the current request when a node gets a
+    new name or parent, which changes the paths of its descendants too.
+    """
+    request = get_current_request()
+    if request is not None and getattr(request, PATHS_ATTR, None):
+        setattr(request, PATHS_ATTR, None)
+
+
+def includeme(config):
+    config.add_resource_url_adapter(IncrementalResourceURL,
+                                    resource_iface=INode)
+    for attribute in (Node.name, Node.parent):
+        if not event.contains(attribute, 'set', forget_paths):
+            event.listen(attribute, 'set', forget_paths, propagate=True)
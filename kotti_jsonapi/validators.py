@@ -0,0 +1,155 @@
+""" Conditional GET
+
+The ``@@json`` and ``@@contents-json`` responses are computed from the
+context, its lineage (breadcrumbs, paths) and its descendants (links,
+listing, included resources), as seen by the current principals.
+:func:`content_etag` derives an ``ETag`` from just the state of those nodes
+and the effective principals, which is much cheaper than serializing.
+:func:`not_modified` uses it to answer ``If-None-Match`` with a
+``304 Not Modified``.
+
+The site chrome served by ``@@chrome-json`` has its own ``ETag``, see
+:func:`chrome_etag`.
+"""
+
+import hashlib
+
+from kotti import DBSession
+from kotti.resources import Content
+from kotti.resources import Node
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.location import lineage
+from webob.datetime_utils import parse_date
+from webob.etag import ETagMatcher
+
+from kotti_jsonapi.messages import has_flash_messages
+from kotti_jsonapi.security import get_permission_evaluator
+from kotti_jsonapi.serializers import JSONTemplateAPI
+
+#: the parameter naming the JSONP callback, see ``kotti_jsonapi.rest.jsonp``
+JSONP_CALLBACK = 'callback'
+
+
+def _children_state(context, level=1):
+    """ Returns the parent ids, ids, positions and modification dates of the
+    descendants of ``context`` ``level`` levels below it (its children by
+    default), in their order.
+    """
+    parents = None
+    for _ in range(level - 1):
+        query = DBSession.query(Node.id)
+        if parents is None:
+            query = query.filter(Node.parent_id == context.id)
+        else:
+            query = query.filter(Node.parent_id.in_(parents))
+        parents = query.subquery()
+    query = DBSession.query(Content.parent_id, Content.id, Content.position,
+                            Content.modification_date)
+    if parents is None:
+        query = query.filter(Content.parent_id == context.id)
+    else:
+        query = query.filter(Content.parent_id.in_(parents))
+    return query.order_by(Content.parent_id, Content.position,
+                          Content.id).all()
+
+
+def _levels(request, levels):
+    include = request.GET.get('include', '')
+    if 'children.children' in include:
+        # the included grandchildren link to their children
+        return max(levels, 3)
+    if 'children' in include:
+        return max(levels, 2)
+    return levels
+
+
+def content_etag(context, request, levels=1):
+    """ Returns the ``ETag`` of the REST representation of ``context``.
+
+    It's derived from the modification dates of the context and its
+    ancestors, the ids, positions and modification dates of its
+    descendants down to ``levels`` levels below it (which also tell about
+    reordered and removed ones), the effective principals and the query
+    parameters but the JSONP callback, which only wraps the document.
+
+    A document links to the children of each node it shows: ``@@json``
+    shows the context (``levels=1``), ``@@contents-json`` its children too
+    (``levels=2``), and each included level of children adds one. Changes
+    that don't touch the context, its ancestors or these descendants, such
+    as edits of sibling navigation items, aren't reflected.
+
+    There's no ``Last-Modified`` date: removing or reordering children
+    doesn't change any.
+    """
+    params = [(key, value) for key, value in request.GET.items()
+              if key != JSONP_CALLBACK]
+    parts = [context.id, sorted(params)]
+    parts.extend(getattr(node, 'modification_date', None)
+                 for node in lineage(context))
+    for level in range(1, _levels(request, levels) + 1):
+        parts.append(_children_state(context, level))
+    principals = get_permission_evaluator(context, request).principals
+    parts.extend(sorted(principals))
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def chrome_etag(context, request):
+    """ Returns the ``ETag`` of the site chrome of ``context``: the current
+    user, the site's title and the navigation items of its navigation root,
+    as seen by the current principals. It's the same for all the pages
+    under that navigation root.
+
+    As for :func:`content_etag`, there's no ``Last-Modified`` date, which
+    removing a navigation item doesn't change.
+    """
+    api = JSONTemplateAPI(context, request)
+    root = api.root
+    navigation_root = api.navigation_root
+    user = request.user
+    if user is not None:
+        user = [user.id, user.name, user.title, user.email,
+                sorted(user.groups or ()), user.last_login_date]
+    principals = get_permission_evaluator(root, request).principals
+
+    parts = [user, root.title, root.modification_date, navigation_root.id,
+             _children_state(navigation_root), request.application_url]
+    parts.extend(sorted(principals))
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def check_validators(request, etag, last_modified=None):
+    """ Sets ``etag`` and ``last_modified`` on ``request.response`` and
+    returns a :class:`~pyramid.httpexceptions.HTTPNotModified` if the
+    client's copy is still fresh, ``None`` otherwise.
+    """
+    response = request.response
+    response.etag = etag
+    response.last_modified = last_modified
+
+    headers = request.headers
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    if 'If-None-Match' in headers:
+        fresh = etag in ETagMatcher.parse(headers['If-None-Match'])
+    elif if_modified_since is not None and last_modified is not None:
+        fresh = last_modified <= if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+
+    result = HTTPNotModified()
+    result.etag = etag
+    result.last_modified = last_modified
+    return result
+
+
+def not_modified(context, request, levels=1):
+    """ Checks the :func:`content_etag` of ``context`` (with ``levels``)
+    with :func:`check_validators`.
+
+    Responses carrying flash messages are never considered fresh.
+    """
+    if has_flash_messages(request):
+        return None
+    return check_validators(request,
+                            content_etag(context, request, levels))
@@ -0,0 +1,94 @@
+""" Precompiled workflow tables
+
+Kotti's ``workflow-dropdown`` view (:func:`kotti.views.edit.actions.workflow`)
+builds the states and transitions of an object from its workflow's raw
+definition every time, and the state data it returns is the workflow's own,
+including the state ``callback`` functions that can't be serialized.
+Deleting those in place broke the workflow for the rest of the process.
+
+:class:`WorkflowTable` copies a workflow's states and transitions once, in
+a JSON ready form and grouped by source state. Describing an object then
+only takes picking its current state and filtering the transitions by the
+permissions granted on it.
+"""
+
+from collections import OrderedDict
+
+from kotti.workflow import get_workflow
+from pyramid.compat import text_type
+
+from kotti_jsonapi.security import permits
+
+WORKFLOWS_KEY = 'kotti_jsonapi.workflows'
+
+
+def _without_callback(data):
+    return dict((key, value) for key, value in data.items()
+                if key != 'callback')
+
+
+class WorkflowTable(object):
+    """ The states and transitions of a :class:`repoze.workflow.Workflow`.
+    """
+
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.states = OrderedDict()
+        for name, data in workflow._state_data.items():
+            self.states[name] = dict(
+                name=name,
+                data=_without_callback(data),
+                initial=name == workflow.initial_state,
+                title=text_type(data.get('title', name)))
+        # transitions by source state
+        self.transitions = dict()
+        for transition in workflow._transition_data.values():
+            self.transitions.setdefault(transition['from_state'], []).append(
+                _without_callback(transition))
+
+    def describe(self, context, request):
+        """ Returns the ``states``, ``transitions`` and ``current_state`` of
+        ``context``, in the format of kotti's ``workflow`` view.
+        """
+        current = self.workflow.state_of(context)
+        granted = dict()
+        transitions = list()
+        for transition in self.transitions.get(current, ()):
+            permission = transition['permission']
+            if permission is not None and permission not in granted:
+                granted[permission] = permits(permission, context, request)
+            if permission is None or granted[permission]:
+                transitions.append(transition)
+
+        states = dict()
+        for name, state in self.states.items():
+            states[name] = dict(
+                state, current=name == current,
+                transitions=[t for t in transitions if t['to_state'] == name])
+        return dict(states=states, transitions=transitions,
+                    current_state=states.get(current))
+
+
+def get_workflow_table(context, request):
+    """ Returns the :class:`WorkflowTable` of the workflow of ``context``,
+    compiled on first use and kept in the registry, or ``None`` if it has no
+    workflow.
+    """
+    workflow = get_workflow(context)
+    if workflow is None:
+        return None
+    tables = request.registry.setdefault(WORKFLOWS_KEY, dict())
+    table = tables.get(id(workflow))
+    if table is None or table.workflow is not workflow:
+        table = tables[id(workflow)] = WorkflowTable(workflow)
+    return table
+
+
+def describe_workflow(context, request):
+    """ Returns the workflow data of ``context`` for
+    :func:`~kotti_jsonapi.serializers.relational_metadata`.
+    """
+    table = get_workflow_table(context, request)
+    if table is None:
+        return dict(current_state=None)
+    return table.describe(context, request)